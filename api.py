@@ -0,0 +1,113 @@
+from flask import Blueprint, current_app, request, abort, url_for
+from sqlalchemy import desc
+from models import BlogPost, User, Comment, db
+from querycount import query_budget
+from cache import page_cache
+from conditional import conditional, current_version, listing_version, post_version
+from dbrouting import replica_reads
+from images import absolute_url
+import json
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library encoder is used without it
+    orjson = None
+
+# Read-only JSON for the mobile app and partner sites. Queries select plain columns and turn the
+# rows straight into dicts without building ORM objects, and the encoded responses go through the
+# page cache under the same tags the write routes already invalidate.
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+POST_COLUMNS = (BlogPost.id, BlogPost.title, BlogPost.subtitle, BlogPost.date, BlogPost.updated_at,
+                BlogPost.img_url, BlogPost.excerpt, BlogPost.reading_time, BlogPost.comment_count,
+                User.name.label('author'))
+
+
+def json_response(payload, status=200):
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode()
+    return current_app.response_class(body, status=status, mimetype='application/json')
+
+
+def timestamp(value):
+    return value.isoformat() + "Z" if value is not None else None
+
+
+def post_dict(row):
+    post = row._asdict()
+    post['date'] = timestamp(post['date'])
+    post['updated_at'] = timestamp(post['updated_at'])
+    post['url'] = url_for('views.show_post', post_id=post['id'], _external=True)
+    post['img_url'] = absolute_url(post['img_url'])
+    return post
+
+
+def page_size():
+    size = request.args.get('limit', current_app.config['API_PAGE_SIZE'], type=int)
+    return min(max(size, 1), current_app.config['API_MAX_PAGE_SIZE'])
+
+
+@api.errorhandler(404)
+def not_found(error):
+    return json_response({"error": "not found"}, 404)
+
+
+# Newest first, ?before=<id of the last post received> for the next page
+@api.route('/posts')
+@query_budget(2)
+@replica_reads
+@conditional(listing_version)
+@page_cache.cached("archive", version=current_version)
+def list_posts():
+    limit = page_size()
+    query = db.select(*POST_COLUMNS).join(BlogPost.author, isouter=True)
+    before = request.args.get('before', type=int)
+    if before is not None:
+        query = query.where(BlogPost.id < before)
+    rows = db.session.execute(query.order_by(desc(BlogPost.id)).limit(limit + 1)).all()
+    posts = [post_dict(row) for row in rows[:limit]]
+    return json_response({"posts": posts, "next": posts[-1]['id'] if len(rows) > limit else None})
+
+
+@api.route('/posts/<int:post_id>')
+@query_budget(2)
+@replica_reads
+@conditional(post_version)
+@page_cache.cached("post:{post_id}", version=current_version)
+def get_post(post_id):
+    row = db.session.execute(
+        db.select(*POST_COLUMNS, BlogPost.body_html)
+        .join(BlogPost.author, isouter=True)
+        .where(BlogPost.id == post_id)
+    ).first()
+    if row is None:
+        abort(404)
+    return json_response(post_dict(row))
+
+
+# Newest first, ?after=<id of the last comment received> for the next page
+@api.route('/posts/<int:post_id>/comments')
+@query_budget(3)
+@replica_reads
+@conditional(post_version)
+@page_cache.cached("post:{post_id}", version=current_version)
+def list_comments(post_id):
+    limit = page_size()
+    query = (
+        db.select(Comment.id, Comment.text, User.name.label('author'), User.email)
+        .join(Comment.comment_author, isouter=True)
+        .where(Comment.post_id == post_id)
+    )
+    after = request.args.get('after', type=int)
+    if after is not None:
+        query = query.where(Comment.id < after)
+    rows = db.session.execute(query.order_by(desc(Comment.id)).limit(limit + 1)).all()
+    if not rows and db.session.execute(db.select(BlogPost.id).where(BlogPost.id == post_id)).first() is None:
+        abort(404)
+    avatar = current_app.jinja_env.filters['avatar']
+    comments = [{"id": row.id, "text": row.text, "author": row.author,
+                 "avatar": avatar(row.email) if row.email else None} for row in rows[:limit]]
+    return json_response({"comments": comments, "next": comments[-1]['id'] if len(rows) > limit else None})
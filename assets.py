@@ -0,0 +1,143 @@
+from flask import current_app, request, send_file, url_for, abort
+from flask.cli import AppGroup
+from werkzeug.security import safe_join
+import click
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+
+try:
+    import brotli
+except ImportError:  # optional, only the gzip copies are written without it
+    brotli = None
+
+# "flask assets build" copies every file in static/ to static/dist/ under a name containing a hash
+# of its content (css/styles.css -> css/styles.1a2b3c4d5e.css), writes .gz and .br copies of the
+# text files, and a manifest mapping the plain names to the hashed ones. Templates ask for
+# asset_url('css/styles.css'), and since a hashed name never changes content it is served with a
+# one-year immutable Cache-Control, in the encoding the browser accepts.
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+# Images and fonts are compressed already, gzip would only make them bigger
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.json', '.txt', '.map', '.html'}
+
+assets_cli = AppGroup('assets', help="Build the fingerprinted static files.")
+
+
+def dist_folder(app):
+    return os.path.join(app.static_folder, DIST)
+
+
+def write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def fingerprinted_name(name, data):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha1(data).hexdigest()[:10]}{ext}"
+
+
+@assets_cli.command('build')
+def build():
+    """Write the fingerprinted and compressed copies of the static files and their manifest."""
+    source = current_app.static_folder
+    dist = dist_folder(current_app)
+    manifest = {}
+    written = 0
+    for dirpath, dirnames, filenames in os.walk(source):
+        if os.path.abspath(dirpath) == os.path.abspath(source) and DIST in dirnames:
+            dirnames.remove(DIST)
+        for filename in filenames:
+            name = os.path.relpath(os.path.join(dirpath, filename), source).replace(os.sep, '/')
+            with open(os.path.join(dirpath, filename), 'rb') as f:
+                data = f.read()
+            hashed = fingerprinted_name(name, data)
+            manifest[name] = hashed
+            target = os.path.join(dist, hashed)
+            # Same name means same content, so anything already built is left alone
+            if os.path.exists(target):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE:
+                write_atomic(target + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    write_atomic(target + '.br', brotli.compress(data, quality=11))
+            write_atomic(target, data)
+            written += 1
+    os.makedirs(dist, exist_ok=True)
+    write_atomic(os.path.join(dist, MANIFEST), json.dumps(manifest, indent=1, sort_keys=True).encode())
+    if brotli is None:
+        click.echo("brotli is not installed, only gzip copies were written", err=True)
+    click.echo(f"{len(manifest)} assets, {written} new")
+
+
+@assets_cli.command('clean')
+def clean():
+    """Delete built files that the current manifest no longer uses."""
+    dist = dist_folder(current_app)
+    with open(os.path.join(dist, MANIFEST)) as f:
+        keep = set(json.load(f).values())
+    removed = 0
+    for dirpath, _, filenames in os.walk(dist):
+        for filename in filenames:
+            name = os.path.relpath(os.path.join(dirpath, filename), dist).replace(os.sep, '/')
+            if name == MANIFEST or name in keep or name.rsplit('.', 1)[0] in keep:
+                continue
+            os.remove(os.path.join(dirpath, filename))
+            removed += 1
+    click.echo(f"Removed {removed} files")
+
+
+def load_manifest(app):
+    try:
+        with open(os.path.join(dist_folder(app), MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# Template helper. Without a build (e.g. in development) the plain static URL is used.
+def asset_url(name):
+    hashed = current_app.extensions['assets'].get(name)
+    if hashed is None:
+        return url_for('static', filename=name)
+    return url_for('asset', filename=hashed)
+
+
+def serve_asset(filename):
+    path = safe_join(dist_folder(current_app), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    max_age = current_app.config['ASSETS_MAX_AGE']
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[encoding] and os.path.isfile(path + suffix):
+            response = send_file(path + suffix, mimetype=mimetype, max_age=max_age, conditional=True)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_file(path, mimetype=mimetype, max_age=max_age, conditional=True)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    app.config.setdefault('ASSETS_MAX_AGE', 31536000)
+    app.extensions['assets'] = load_manifest(app)
+    # More specific than Flask's /static/<path> rule, so the built files are answered here
+    app.add_url_rule(f"{app.static_url_path}/{DIST}/<path:filename>", 'asset', serve_asset)
+    app.jinja_env.globals['asset_url'] = asset_url
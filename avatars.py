@@ -0,0 +1,130 @@
+from functools import lru_cache
+from flask import current_app, request, url_for, abort
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+from cache import FileSystemCache
+import hashlib
+import io
+import logging
+import os
+import re
+
+try:
+    from PIL import Image as PILImage, ImageOps
+except ImportError:  # optional, avatars are cached at the size Gravatar sent without it
+    PILImage = None
+
+# Avatar links for the comment lists. The Gravatar hash of an email is worked out once per process
+# instead of on every render. With AVATAR_PROXY on, the links point at /avatar/<hash> on this site,
+# which fetches the image from Gravatar once, resizes it and keeps it in a disk cache shared by the
+# workers (least recently used files are evicted past AVATAR_CACHE_SIZE), so a post with a hundred
+# commenters costs the browser no third-party connections. Emails without a Gravatar, and fetches
+# that fail, get static/assets/img/default-profile.jpg.
+#
+# AVATAR_BASE_URL can point at a local stand-in (see benchmarks/avatar_server.py) for testing.
+
+DEFAULT_IMAGE = 'assets/img/default-profile.jpg'
+HASH = re.compile(r'^[0-9a-f]{32}$')
+MAX_BYTES = 1024 * 1024  # larger answers are not avatars
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=10000)
+def avatar_hash(email):
+    return hashlib.md5(email.strip().lower().encode('utf-8')).hexdigest()
+
+
+# Template filter: {{ user.email | avatar }}
+def avatar_url(email, size=None):
+    config = current_app.config
+    size = size or config['AVATAR_SIZE']
+    if config['AVATAR_PROXY']:
+        return url_for('avatar', digest=avatar_hash(email), s=size)
+    query = urlencode({"s": size, "d": config['AVATAR_DEFAULT'], "r": config['AVATAR_RATING']})
+    return f"{config['AVATAR_BASE_URL']}{avatar_hash(email)}?{query}"
+
+
+def resize(data, size):
+    with PILImage.open(io.BytesIO(data)) as im:
+        im = ImageOps.fit(im.convert('RGB'), (size, size), PILImage.LANCZOS)
+        buffer = io.BytesIO()
+        im.save(buffer, 'JPEG', quality=85, optimize=True)
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=8)
+def default_avatar(path, size):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return resize(data, size) if PILImage is not None else data
+
+
+# (image bytes or None, seconds to keep the answer). None means the default image.
+def fetch(digest, size):
+    config = current_app.config
+    query = urlencode({"s": size, "d": "404", "r": config['AVATAR_RATING']})
+    try:
+        with urlopen(f"{config['AVATAR_BASE_URL']}{digest}?{query}", timeout=config['AVATAR_FETCH_TIMEOUT']) as remote:
+            data = remote.read(MAX_BYTES + 1)
+    except HTTPError as e:
+        if e.code == 404:  # no Gravatar for this email
+            return None, config['AVATAR_TTL']
+        logger.warning("Avatar %s: Gravatar answered %s", digest, e.code)
+        return None, config['AVATAR_RETRY_TTL']
+    except (OSError, ValueError) as e:
+        logger.warning("Avatar %s: %s", digest, e)
+        return None, config['AVATAR_RETRY_TTL']
+    if len(data) > MAX_BYTES:
+        return None, config['AVATAR_TTL']
+    if PILImage is not None:
+        try:
+            data = resize(data, size)
+        except Exception:
+            return None, config['AVATAR_TTL']
+    return data, config['AVATAR_TTL']
+
+
+def serve_avatar(digest):
+    if not HASH.match(digest):
+        abort(404)
+    config = current_app.config
+    size = request.args.get('s', config['AVATAR_SIZE'], type=int)
+    if size not in config['AVATAR_SIZES']:  # keeps the cache to a few copies per avatar
+        size = config['AVATAR_SIZE']
+    store = current_app.extensions['avatars']
+    key = f"{digest}:{size}"
+    data = store.get(key)
+    if data is None:
+        data, ttl = fetch(digest, size)
+        if data is None:
+            data = default_avatar(os.path.join(current_app.static_folder, DEFAULT_IMAGE), size)
+        store.set(key, data, ttl=ttl)
+    response = current_app.response_class(data, mimetype='image/jpeg')
+    response.set_etag(hashlib.sha1(data).hexdigest())
+    response.cache_control.public = True
+    response.cache_control.max_age = config['AVATAR_MAX_AGE']
+    return response.make_conditional(request)
+
+
+def init_app(app):
+    app.config.setdefault('AVATAR_SIZE', 100)
+    app.config.setdefault('AVATAR_SIZES', [app.config['AVATAR_SIZE']])
+    app.config.setdefault('AVATAR_DEFAULT', 'retro')
+    app.config.setdefault('AVATAR_RATING', 'g')
+    app.config.setdefault('AVATAR_BASE_URL', 'https://secure.gravatar.com/avatar/')
+    app.config.setdefault('AVATAR_PROXY', False)
+    app.jinja_env.filters['avatar'] = avatar_url
+    if not app.config['AVATAR_PROXY']:
+        return
+    app.config.setdefault('AVATAR_DIR', None)
+    app.config.setdefault('AVATAR_CACHE_SIZE', 5000)
+    app.config.setdefault('AVATAR_TTL', 86400)
+    app.config.setdefault('AVATAR_RETRY_TTL', 300)
+    app.config.setdefault('AVATAR_MAX_AGE', 86400)
+    app.config.setdefault('AVATAR_FETCH_TIMEOUT', 3)
+    app.extensions['avatars'] = FileSystemCache(app.config['AVATAR_DIR'] or os.path.join(app.instance_path, 'avatars'),
+                                                max_entries=app.config['AVATAR_CACHE_SIZE'],
+                                                ttl=app.config['AVATAR_TTL'])
+    app.add_url_rule('/avatar/<digest>', 'avatar', serve_avatar)
@@ -0,0 +1,59 @@
+# A local stand-in for Gravatar, so the avatar proxy (avatars.py) can be tried and load tested
+# without calling the real service. Point the app at it with
+#
+#   python -m benchmarks.avatar_server --port 8001 --missing 0.5 --delay 50
+#   AVATAR_PROXY=1 AVATAR_BASE_URL=http://127.0.0.1:8001/avatar/ flask --app main run
+#
+# Every hash gets a square in a colour taken from the hash, at the ?s= size, except a share of
+# them (--missing) that answer 404 as Gravatar does for emails it does not know with ?d=404.
+import argparse
+import io
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from PIL import Image
+
+
+def make_handler(missing, delay):
+    class AvatarHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            digest = url.path.rsplit("/", 1)[-1]
+            size = int(parse_qs(url.query).get("s", ["80"])[0])
+            time.sleep(delay / 1000)
+            try:
+                value = int(digest[:8], 16)
+            except ValueError:
+                value = -1
+            if value < 0 or value / 0xFFFFFFFF < missing:
+                self.send_error(404)
+                return
+            buffer = io.BytesIO()
+            Image.new("RGB", (size, size), tuple(bytes.fromhex(digest[:6]))).save(buffer, "JPEG")
+            body = buffer.getvalue()
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return AvatarHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fake Gravatar images for local testing.")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--missing", type=float, default=0.0, help="Share of hashes without an avatar (0-1)")
+    parser.add_argument("--delay", type=float, default=0, help="Milliseconds added to every answer")
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args.missing, args.delay))
+    print(f"Serving fake avatars on http://127.0.0.1:{args.port}/avatar/")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
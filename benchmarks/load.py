@@ -0,0 +1,384 @@
+# Drives every main route against a seeded database (see seed.py) and reports throughput, latency
+# percentiles, SQL statements and peak memory per route. Results are saved as JSON so two commits
+# can be compared, and the run fails when a route got slower than the baseline by more than the threshold.
+#
+#   python -m benchmarks.load --db sqlite:///bench.db --save before.json
+#   python -m benchmarks.load --db sqlite:///bench.db --baseline before.json --threshold 0.15
+#   python -m benchmarks.load --db sqlite:///bench.db --server gunicorn --workers 4 --concurrency 8
+#
+import argparse
+import http.client
+import json
+import os
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from benchmarks.seed import PASSWORD, WORDS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Scenario:
+    def __init__(self, name, method, make_path, make_data=None, logged_in=False, requests=None):
+        self.name = name
+        self.method = method
+        self.make_path = make_path
+        self.make_data = make_data
+        self.logged_in = logged_in
+        self.requests = requests  # overrides --requests, for the slow routes
+
+
+def scenarios(dataset, args):
+    posts = dataset["posts"]
+    years = dataset["years"]
+
+    def random_post(rng):
+        return rng.randint(1, posts)
+
+    return [
+        Scenario("index", "GET", lambda rng: "/"),
+        Scenario("archive", "GET", lambda rng: "/blog-archive"),
+        Scenario("archive_page", "GET", lambda rng: f"/blog-archive?before={rng.randint(2, posts)}"),
+        Scenario("archive_year", "GET", lambda rng: f"/archive/{rng.choice(years)}"),
+        Scenario("search", "GET", lambda rng: "/search?" + urlencode({"q": rng.choice(WORDS)})),
+        Scenario("post", "GET", lambda rng: f"/post/{random_post(rng)}"),
+        Scenario("post_comments", "GET", lambda rng: f"/post/{random_post(rng)}/comments"),
+        Scenario("about", "GET", lambda rng: "/about"),
+        Scenario("comment", "POST", lambda rng: f"/post/{random_post(rng)}",
+                 lambda rng: {"comment_text": " ".join(rng.choice(WORDS) for _ in range(12))}, logged_in=True),
+        # Every login hashes a password on purpose, so this one gets far fewer requests
+        Scenario("login", "POST", lambda rng: "/login",
+                 lambda rng: {"email": f"user{rng.randint(1, dataset['users'])}@example.com", "password": PASSWORD},
+                 requests=args.login_requests),
+    ]
+
+
+# Settings for the app under test: statement counting on, CSRF and rate limits off so the forms can be posted
+def app_config(args):
+    return {
+        "SQLALCHEMY_DATABASE_URI": args.db,
+        "QUERY_BUDGET_MODE": "log",
+        "WTF_CSRF_ENABLED": False,
+        "RATE_LIMIT_ENABLED": False,
+        "PAGE_CACHE_BACKEND": args.page_cache,
+    }
+
+
+def describe_dataset(app):
+    from models import db, BlogPost, Comment, User
+    with app.app_context():
+        count = lambda column: db.session.execute(db.select(db.func.count(column))).scalar()
+        dates = db.session.execute(db.select(db.func.min(BlogPost.date), db.func.max(BlogPost.date))).one()
+        if not count(BlogPost.id):
+            raise SystemExit("The database has no posts, seed it first with python -m benchmarks.seed")
+        return {
+            "users": count(User.id),
+            "posts": count(BlogPost.id),
+            "comments": count(Comment.id),
+            "years": list(range(dates[0].year, dates[1].year + 1)),
+        }
+
+
+# In-process driver: the Flask test client, no network or server in the way
+class TestClientDriver:
+    def __init__(self, app):
+        self.app = app
+        self.client = app.test_client()
+
+    def login(self, email):
+        self.client.post("/login", data={"email": email, "password": PASSWORD})
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code, int(response.headers.get("X-Query-Count", 0))
+
+    def peak_rss_kb(self):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def close(self):
+        pass
+
+
+# Network driver: a local gunicorn started from this checkout, one keep-alive connection per thread
+class HTTPDriver:
+    def __init__(self, host, port, server=None):
+        self.host = host
+        self.port = port
+        self.server = server
+        self.local = threading.local()
+        self.cookies = {}
+
+    def connection(self):
+        if getattr(self.local, "conn", None) is None:
+            self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        return self.local.conn
+
+    def login(self, email):
+        self.request("POST", "/login", {"email": email, "password": PASSWORD})
+
+    def request(self, method, path, data=None):
+        headers = {}
+        body = None
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+        if data is not None:
+            body = urlencode(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        conn = self.connection()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self.local.conn = None
+            raise
+        for header in response.headers.get_all("Set-Cookie") or []:
+            cookie = SimpleCookie(header)
+            for key, morsel in cookie.items():
+                self.cookies[key] = morsel.value
+        return response.status, int(response.headers.get("X-Query-Count", 0))
+
+    # Highest resident memory of any gunicorn worker, read from /proc (Linux only)
+    def peak_rss_kb(self):
+        if self.server is None:
+            return None
+        peaks = []
+        for pid in [self.server.pid] + child_pids(self.server.pid):
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmHWM:"):
+                            peaks.append(int(line.split()[1]))
+            except OSError:
+                continue
+        return max(peaks) if peaks else None
+
+    def close(self):
+        if self.server is not None:
+            self.server.terminate()
+            self.server.wait(timeout=30)
+
+
+def child_pids(parent):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The process name can contain spaces, the parent pid is the second field after it
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[1]) == parent:
+            children.append(int(entry))
+    return children
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(args):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(args.workers),
+         "--threads", str(args.threads), "--log-level", "warning", f"main:create_app({app_config(args)!r})"],
+        cwd=ROOT,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server, port
+        except OSError:
+            if server.poll() is not None:
+                raise SystemExit("gunicorn exited during startup")
+            time.sleep(0.1)
+    server.terminate()
+    raise SystemExit("gunicorn did not start in 30 seconds")
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(driver, scenario, requests, concurrency, warmup, rng):
+    latencies = []
+    statements = []
+    errors = 0
+    lock = threading.Lock()
+    # Draw every path up front so the threads do not share the random generator
+    plan = [(scenario.make_path(rng), scenario.make_data(rng) if scenario.make_data else None)
+            for _ in range(warmup + requests)]
+    for path, data in plan[:warmup]:
+        driver.request(scenario.method, path, data)
+    work = iter(plan[warmup:])
+
+    def worker():
+        nonlocal errors
+        while True:
+            with lock:
+                item = next(work, None)
+            if item is None:
+                return
+            started = time.perf_counter()
+            try:
+                status, count = driver.request(scenario.method, *item)
+            except (http.client.HTTPException, OSError):
+                status, count = 599, 0
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statements.append(count)
+                if status >= 400:
+                    errors += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": len(latencies) / wall,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "statements_mean": statistics.fmean(statements),
+        "statements_max": max(statements),
+        "peak_rss_kb": driver.peak_rss_kb(),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# A route regresses when its p95 latency or throughput is worse than the baseline by more than
+# the threshold, or when it runs more SQL statements per request than before
+def compare(results, baseline, threshold):
+    failures = []
+    for name, current in results["routes"].items():
+        before = baseline["routes"].get(name)
+        if before is None:
+            continue
+        if current["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            failures.append(f"{name}: p95 {before['p95_ms']:.1f} ms -> {current['p95_ms']:.1f} ms")
+        if current["throughput_rps"] < before["throughput_rps"] * (1 - threshold):
+            failures.append(f"{name}: throughput {before['throughput_rps']:.1f} -> {current['throughput_rps']:.1f} req/s")
+        if current["statements_mean"] > before["statements_mean"] + 0.01:
+            failures.append(f"{name}: SQL statements {before['statements_mean']:.2f} -> {current['statements_mean']:.2f}")
+    return failures
+
+
+def print_table(results):
+    print(f"{'route':<15}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'SQL':>6}{'errors':>8}{'peak RSS':>11}")
+    for name, r in results["routes"].items():
+        rss = f"{r['peak_rss_kb'] / 1024:.0f} MB" if r["peak_rss_kb"] else "-"
+        print(f"{name:<15}{r['throughput_rps']:>9.1f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}"
+              f"{r['statements_mean']:>6.1f}{r['errors']:>8}{rss:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the blog routes against a seeded database.")
+    parser.add_argument("--db", required=True, help="Database URL seeded with benchmarks.seed")
+    parser.add_argument("--server", choices=["testclient", "gunicorn"], default="testclient")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=1, help="gunicorn threads per worker")
+    parser.add_argument("--concurrency", type=int, default=1, help="Client threads (gunicorn only)")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per route")
+    parser.add_argument("--login-requests", type=int, default=20, help="Measured requests for the login route")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests per route")
+    parser.add_argument("--route", action="append", help="Only run these routes, can be repeated")
+    parser.add_argument("--page-cache", default="null", help="PAGE_CACHE_BACKEND for the run, null measures the views")
+    parser.add_argument("--random-seed", type=int, default=1)
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results saved by an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed slowdown, 0.15 = 15%%")
+    args = parser.parse_args()
+
+    from main import create_app
+    app = create_app(app_config(args))
+    dataset = describe_dataset(app)
+
+    if args.server == "gunicorn":
+        server, port = start_gunicorn(args)
+        driver = HTTPDriver("127.0.0.1", port, server)
+        concurrency = args.concurrency
+    else:
+        driver = TestClientDriver(app)
+        concurrency = 1
+
+    rng = random.Random(args.random_seed)
+    results = {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "server": args.server,
+        "workers": args.workers if args.server == "gunicorn" else None,
+        "concurrency": concurrency,
+        "page_cache": args.page_cache,
+        "dataset": {key: dataset[key] for key in ("users", "posts", "comments")},
+        "routes": {},
+    }
+    try:
+        # The admin (user 4 when seeded) would see extra buttons, comment as an ordinary user instead
+        logged_in = False
+        for scenario in scenarios(dataset, args):
+            if args.route and scenario.name not in args.route:
+                continue
+            if scenario.logged_in and not logged_in:
+                driver.login("user1@example.com")
+                logged_in = True
+            requests = scenario.requests or args.requests
+            results["routes"][scenario.name] = run_scenario(driver, scenario, requests, concurrency,
+                                                            min(args.warmup, requests), rng)
+    finally:
+        driver.close()
+
+    print_table(results)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("dataset") != results["dataset"]:
+            print(f"warning: {args.baseline} was measured on a different dataset {baseline.get('dataset')}",
+                  file=sys.stderr)
+        failures = compare(results, baseline, args.threshold)
+        if failures:
+            print(f"\nRegressions against {args.baseline} (commit {baseline.get('commit')}):", file=sys.stderr)
+            for failure in failures:
+                print(f"  {failure}", file=sys.stderr)
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline} (commit {baseline.get('commit')})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# Measures how fast the new-post mailing (mailings.py) gets through a list of subscribers, against
+# a local SMTP sink that fakes the slow parts of a real provider: setting up a connection (TLS and
+# login) and accepting each message. The first run logs in once per message, the way mail used to
+# be sent; the others reuse pooled connections.
+#
+#   python -m benchmarks.mailing --subscribers 2000 --connections 1,2,4 --connect-ms 100 --message-ms 5
+#
+import argparse
+import os
+import socketserver
+import tempfile
+import threading
+import time
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, text):
+        self.wfile.write(text.encode() + b"\r\n")
+
+    def handle(self):
+        sink = self.server
+        with sink.lock:
+            sink.connections += 1
+        time.sleep(sink.connect_delay)
+        self.reply("220 sink ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command = line[:4].upper()
+            if command == b"EHLO":
+                self.reply("250-sink\r\n250 8BITMIME")
+            elif command in (b"HELO", b"MAIL", b"RCPT", b"RSET", b"NOOP"):
+                self.reply("250 OK")
+            elif command == b"DATA":
+                self.reply("354 go ahead")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                time.sleep(sink.message_delay)
+                with sink.lock:
+                    sink.messages += 1
+                self.reply("250 queued")
+            elif command == b"QUIT":
+                self.reply("221 bye")
+                break
+            else:
+                self.reply("502 not implemented")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, connect_delay, message_delay):
+        super().__init__(("127.0.0.1", 0), SinkHandler)
+        self.connect_delay = connect_delay
+        self.message_delay = message_delay
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+
+
+def seed(db, subscribers):
+    from models import BlogPost, User
+    from content import process_post
+    db.create_all()
+    db.session.execute(db.insert(User), [
+        {"email": f"reader{i}@example.com", "password": "-", "name": f"Reader {i}", "subscribed": True}
+        for i in range(1, subscribers + 1)
+    ])
+    post = BlogPost(title="Benchmark post", subtitle="Mailed to every subscriber", body="<p>Hello readers.</p>",
+                    img_url="https://example.com/image.jpg", author_id=1)
+    process_post(post)
+    db.session.add(post)
+    db.session.commit()
+    return post.id
+
+
+def run(app, db, post_id, sink, connections, per_connection):
+    from models import Mailing
+    from mailings import send_mailing
+    app.config.update(MAILING_CONNECTIONS=connections, MAILING_MESSAGES_PER_CONNECTION=per_connection)
+    mailing = Mailing(post_id=post_id, base_url="http://localhost/", status="sending")
+    db.session.add(mailing)
+    db.session.commit()
+    sink.connections = sink.messages = 0
+    started = time.perf_counter()
+    send_mailing(mailing)
+    elapsed = time.perf_counter() - started
+    return {"connections": connections, "per_connection": per_connection, "sent": mailing.sent,
+            "failed": mailing.failed + mailing.deferred, "logins": sink.connections,
+            "seconds": elapsed, "rate": mailing.sent / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the new-post mailing against a local SMTP sink.")
+    parser.add_argument("--subscribers", type=int, default=2000)
+    parser.add_argument("--connections", default="1,2,4", help="Comma separated pool sizes to try")
+    parser.add_argument("--per-connection", type=int, default=100, help="Messages before logging in again")
+    parser.add_argument("--connect-ms", type=float, default=100, help="Sink delay for a new connection (TLS, login)")
+    parser.add_argument("--message-ms", type=float, default=5, help="Sink delay to accept a message")
+    parser.add_argument("--baseline-subscribers", type=int, default=200,
+                        help="Subscribers for the one-login-per-message run, it is slow")
+    args = parser.parse_args()
+
+    sink = SMTPSink(args.connect_ms / 1000, args.message_ms / 1000)
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+
+    from main import create_app
+    from models import db
+    config = {"MAIL_SERVER": "127.0.0.1", "MAIL_PORT": sink.server_address[1], "MAIL_USE_TLS": False,
+              "MAIL_USERNAME": None, "MAILING_FROM": "blog@example.com", "MAILING_RATE": 0}
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for subscribers, runs in ((args.baseline_subscribers, [(1, 1)]),
+                                  (args.subscribers, [(int(c), args.per_connection)
+                                                      for c in args.connections.split(",")])):
+            path = os.path.join(directory, f"mailing-{subscribers}.db")
+            app = create_app(dict(config, SQLALCHEMY_DATABASE_URI=f"sqlite:///{path}"))
+            with app.app_context():
+                post_id = seed(db, subscribers)
+                for connections, per_connection in runs:
+                    results.append(run(app, db, post_id, sink, connections, per_connection))
+                db.engine.dispose()
+
+    print(f"{'connections':>11} {'msgs/conn':>9} {'sent':>6} {'failed':>6} {'logins':>6} {'seconds':>8} {'msgs/sec':>9}")
+    for r in results:
+        print(f"{r['connections']:>11} {r['per_connection']:>9} {r['sent']:>6} {r['failed']:>6} {r['logins']:>6} "
+              f"{r['seconds']:>8.2f} {r['rate']:>9.1f}")
+    sink.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# Fills a database with a large, reproducible dataset for the load tests. Rows are written with
+# bulk INSERTs in batches, so a million comments take minutes rather than hours.
+#
+#   python -m benchmarks.seed --db sqlite:///bench.db --users 100000 --posts 10000 --comments 1000000
+#
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+# Every seeded user can log in with this password, the load test uses it for the login route
+PASSWORD = "benchmark-password"
+
+WORDS = (
+    "python flask database query index cache latency request response server worker thread process "
+    "memory disk network socket template render page post comment author archive search travel "
+    "coffee morning evening garden mountain river city street window music guitar book story "
+    "people friend family weekend holiday summer winter rain light shadow color design build test"
+).split()
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def post_body(rng):
+    paragraphs = []
+    for _ in range(rng.randint(3, 12)):
+        paragraphs.append("<p>" + " ".join(sentence(rng, rng.randint(6, 18)) for _ in range(rng.randint(2, 6))) + "</p>")
+    return "".join(paragraphs)
+
+
+def insert_batches(db, model, rows, batch_size, label):
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            db.session.execute(db.insert(model), batch)
+            db.session.commit()
+            total += len(batch)
+            batch = []
+            print(f"\r{label}: {total}", end="", file=sys.stderr)
+    if batch:
+        db.session.execute(db.insert(model), batch)
+        db.session.commit()
+        total += len(batch)
+    print(f"\r{label}: {total}", file=sys.stderr)
+
+
+def user_rows(count, password_hash):
+    for i in range(1, count + 1):
+        yield {"email": f"user{i}@example.com", "password": password_hash, "name": f"User {i}"}
+
+
+def post_rows(rng, count, users, now):
+    from content import process_post
+    # Posts are written by the first few users (the admin is user 4), one every few hours going back in time
+    authors = list(range(1, min(users, 5) + 1))
+    for i in range(1, count + 1):
+        date = now - timedelta(hours=(count - i) * 7, minutes=rng.randint(0, 59))
+        post = SimpleNamespace(body=post_body(rng))
+        process_post(post)
+        yield {
+            "author_id": rng.choice(authors),
+            "title": f"{sentence(rng, rng.randint(3, 7))[:-1]} #{i}",
+            "subtitle": sentence(rng, rng.randint(5, 10)),
+            "date": date,
+            "updated_at": date,
+            "body": post.body,
+            "img_url": "https://images.unsplash.com/photo-1501785888041-af3ef285b470",
+            "body_html": post.body_html,
+            "body_text": post.body_text,
+            "excerpt": post.excerpt,
+            "word_count": post.word_count,
+            "reading_time": post.reading_time,
+        }
+
+
+def comment_rows(rng, count, users, posts):
+    for i in range(1, count + 1):
+        yield {
+            "text": sentence(rng, rng.randint(4, 30)),
+            "author_id": rng.randint(1, users),
+            "post_id": rng.randint(1, posts),
+        }
+
+
+def seed(app, users, posts, comments, batch_size=5000, random_seed=1, reset=False):
+    from flask_migrate import stamp
+    from models import db, BlogPost, Comment, User, utcnow
+    from passwords import hash_password
+
+    rng = random.Random(random_seed)
+    with app.app_context():
+        if reset:
+            db.drop_all()
+            if db.engine.dialect.name == "sqlite":
+                # The FTS5 index is not a model table, drop_all leaves it behind
+                db.session.execute(db.text("DROP TABLE IF EXISTS blog_posts_fts"))
+                db.session.commit()
+        db.create_all()
+        stamp(directory=os.path.join(app.root_path, "migrations"))
+        if db.session.execute(db.select(db.func.count(User.id))).scalar():
+            raise SystemExit("The database already has data, use --reset to replace it.")
+
+        started = time.perf_counter()
+        # One hash shared by every user, hashing 100k passwords would take longer than the rest together
+        insert_batches(db, User, user_rows(users, hash_password(PASSWORD)), batch_size, "users")
+        insert_batches(db, BlogPost, post_rows(rng, posts, users, utcnow()), batch_size, "posts")
+        insert_batches(db, Comment, comment_rows(rng, comments, users, posts), batch_size, "comments")
+
+        comment_counts = (
+            db.select(db.func.count(Comment.id))
+            .where(Comment.post_id == BlogPost.id)
+            .scalar_subquery()
+        )
+        db.session.execute(db.update(BlogPost).values(comment_count=comment_counts)
+                           .execution_options(synchronize_session=False))
+        db.session.commit()
+        print(f"Seeded in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a database for the load tests.")
+    parser.add_argument("--db", required=True, help="Database URL, e.g. sqlite:///bench.db")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=500)
+    parser.add_argument("--comments", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=5000, help="Rows per INSERT")
+    parser.add_argument("--random-seed", type=int, default=1, help="Same seed, same data")
+    parser.add_argument("--reset", action="store_true", help="Drop all tables first")
+    args = parser.parse_args()
+
+    from main import create_app
+    app = create_app({"SQLALCHEMY_DATABASE_URI": args.db, "PASSWORD_HASH_WORKERS": 0})
+    seed(app, max(args.users, 1), max(args.posts, 1), args.comments, args.batch_size, args.random_seed, args.reset)
+
+
+if __name__ == "__main__":
+    main()
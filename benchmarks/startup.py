@@ -0,0 +1,58 @@
+# Measures how long a fresh worker takes from the first import to its first response, the way
+# every gunicorn worker starts. Each run is a new Python process so nothing is already imported.
+#
+#   python -m benchmarks.startup --runs 10 --path /
+#
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+WORKER = """
+import json
+import time
+started = time.perf_counter()
+from main import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+response = app.test_client().get({path!r})
+finished = time.perf_counter()
+print(json.dumps({{"import": imported - started, "create_app": created - imported,
+                  "first_response": finished - created, "total": finished - started,
+                  "status": response.status_code}}))
+"""
+
+
+def run_once(path):
+    output = subprocess.run([sys.executable, "-c", WORKER.format(path=path)],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time import to first response of a fresh worker.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/", help="URL requested as the first response")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    runs = [run_once(args.path) for _ in range(args.runs)]
+    if any(run["status"] != 200 for run in runs):
+        print(f"warning: {args.path} did not return 200 in every run", file=sys.stderr)
+
+    summary = {}
+    for step in ("import", "create_app", "first_response", "total"):
+        values = [run[step] * 1000 for run in runs]
+        summary[step] = {"median_ms": statistics.median(values), "min_ms": min(values), "max_ms": max(values)}
+        print(f"{step:<15} median {summary[step]['median_ms']:8.1f} ms   "
+              f"min {summary[step]['min_ms']:8.1f} ms   max {summary[step]['max_ms']:8.1f} ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"runs": runs, "summary": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
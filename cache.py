@@ -0,0 +1,226 @@
+from collections import OrderedDict
+from functools import wraps
+from flask import request, session, current_app, make_response
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+
+# In-process LRU cache, every gunicorn worker keeps its own copy
+class MemoryCache:
+    def __init__(self, max_entries=500, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Cache stored as one file per key so all workers on the machine share it
+class FileSystemCache:
+    def __init__(self, cache_dir, max_entries=2000, ttl=300, prune_every=50):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self._writes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires is not None and expires < time.time():
+            self._remove(path)
+            return None
+        # Bump the mtime so pruning drops the least recently used files first
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl else None
+        # Write to a temp file and rename it so other workers never read half a file
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((expires, value), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            self._remove(tmp)
+            return
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def delete(self, key):
+        self._remove(self._path(key))
+
+    def clear(self):
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file():
+                self._remove(entry.path)
+
+    def prune(self):
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.tmp') or not entry.is_file():
+                continue
+            try:
+                files.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                continue
+        if len(files) <= self.max_entries:
+            return
+        files.sort()
+        for _, path in files[:len(files) - self.max_entries]:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def cache_dir_from_config(app, prefix):
+    return app.config.get(f'{prefix}_DIR') or os.path.join(app.instance_path, prefix.lower())
+
+
+# Picks a backend from the app config, e.g. prefix "PAGE_CACHE" reads PAGE_CACHE_BACKEND, PAGE_CACHE_TTL...
+def backend_from_config(app, prefix):
+    kind = app.config.get(f'{prefix}_BACKEND', 'memory')
+    ttl = app.config.get(f'{prefix}_TTL', 300)
+    size = app.config.get(f'{prefix}_SIZE', 500)
+    if kind == 'null':
+        return None
+    if kind == 'filesystem':
+        return FileSystemCache(cache_dir_from_config(app, prefix), max_entries=size, ttl=ttl)
+    if kind == 'memory':
+        return MemoryCache(max_entries=size, ttl=ttl)
+    raise ValueError(f"Unknown {prefix}_BACKEND: {kind}")
+
+
+# Caches rendered pages per URL. Every entry is stored under the current generation of its tags,
+# so invalidating a tag just starts a new generation and the old entries are never read again.
+# The generations are always files under PAGE_CACHE_DIR/generations, so an invalidation by any
+# worker or CLI command on the machine reaches every worker, whichever backend holds the pages.
+# Servers on other machines only see it through the database versions (see conditional.py).
+class PageCache:
+    def __init__(self, app=None):
+        self.backend = None
+        self.generations = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = backend_from_config(app, 'PAGE_CACHE')
+        if self.backend is not None:
+            self.generations = FileSystemCache(os.path.join(cache_dir_from_config(app, 'PAGE_CACHE'), 'generations'),
+                                               max_entries=app.config.get('PAGE_CACHE_GENERATIONS', 20000), ttl=0)
+        app.extensions['page_cache'] = self
+
+    def generation(self, tag):
+        key = f'gen:{tag}'
+        gen = self.generations.get(key)
+        if gen is None:
+            # A missing generation (never set or evicted) always starts a fresh one,
+            # so an eviction can only cause misses and never serve a stale page.
+            gen = str(time.time_ns())
+            self.generations.set(key, gen, ttl=0)
+        return gen
+
+    def invalidate(self, *tags):
+        if self.backend is None:
+            return
+        for tag in tags:
+            self.generations.set(f'gen:{tag}', str(time.time_ns()), ttl=0)
+
+    # Anonymous readers share one copy. Logged-in users see their name, admin buttons and a CSRF
+    # token in the page, so they get their own copy tied to their session's CSRF secret.
+    def viewer(self):
+        if not current_user.is_authenticated:
+            return 'anon'
+        generate_csrf()
+        secret = session.get(current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'), '')
+        return f"user:{current_user.id}:{hashlib.sha1(secret.encode()).hexdigest()[:16]}"
+
+    def make_key(self, tags, version=None):
+        gens = ','.join(self.generation(tag) for tag in tags)
+        key = f"page:{request.full_path}:{self.viewer()}:{gens}"
+        return f"{key}:{version()}" if version is not None else key
+
+    # Decorator for GET views. Tags can use the view arguments, e.g. cached("post:{post_id}").
+    # version, a function, is added to the key for pages that also change without a write,
+    # so a cached body always matches the ETag sent with it.
+    def cached(self, *tags, version=None):
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if self.backend is None or request.method not in ('GET', 'HEAD'):
+                    return f(*args, **kwargs)
+
+                key = self.make_key([tag.format(**kwargs) for tag in tags], version)
+                hit = self.backend.get(key)
+                if hit is not None:
+                    body, status, content_type = hit
+                    response = current_app.response_class(body, status=status, content_type=content_type)
+                    response.headers['X-Page-Cache'] = 'HIT'
+                    return response
+
+                response = make_response(f(*args, **kwargs))
+                if response.status_code == 200 and not response.direct_passthrough:
+                    self.backend.set(key, (response.get_data(), response.status_code,
+                                           response.headers.get('Content-Type')))
+                    response.headers['X-Page-Cache'] = 'MISS'
+                return response
+
+            return decorated_function
+
+        return decorator
+
+
+page_cache = PageCache()
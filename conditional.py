@@ -0,0 +1,76 @@
+from functools import wraps
+from flask import g, request, current_app, make_response
+from werkzeug.http import is_resource_modified
+from sqlalchemy import func
+from models import BlogPost, db
+from cache import page_cache
+import hashlib
+import time
+
+
+# Validators for the listing pages: any new, edited or deleted post changes the newest timestamp or the count
+def listing_version():
+    last_modified, count = db.session.execute(
+        db.select(func.max(BlogPost.updated_at), func.count(BlogPost.id))
+    ).one()
+    return last_modified, f"{last_modified}:{count}"
+
+
+def post_version(post_id):
+    last_modified = db.session.execute(
+        db.select(BlogPost.updated_at).where(BlogPost.id == post_id)
+    ).scalar()
+    return last_modified, f"{post_id}:{last_modified}"
+
+
+# The same URL renders differently per viewer, so the viewer is part of the ETag. Logged-in pages
+# carry a CSRF token that expires, so their ETag also rolls over before the token does.
+def make_etag(version):
+    viewer = page_cache.viewer()
+    if viewer != 'anon':
+        token_lifetime = current_app.config.get('WTF_CSRF_TIME_LIMIT') or 3600
+        viewer += f":{int(time.time() // (token_lifetime / 2))}"
+    return hashlib.sha1(f"{request.full_path}|{version}|{viewer}".encode()).hexdigest()
+
+
+def add_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+# The version the running conditional() view was validated against. Pass it to page_cache.cached()
+# underneath so a cached body is only served with the ETag it was rendered for, even when another
+# worker or process changed the database without invalidating this worker's cache.
+def current_version():
+    return g.get('validator_version')
+
+
+# Decorator for GET views that answers If-None-Match / If-Modified-Since with a 304 before the view runs.
+# validator gets the view arguments and returns (last_modified, version), last_modified None means no validators.
+def conditional(validator):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return f(*args, **kwargs)
+
+            last_modified, version = validator(**kwargs)
+            g.validator_version = version
+            if last_modified is None:
+                return f(*args, **kwargs)
+
+            etag = make_etag(version)
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                return add_validators(current_app.response_class(status=304), etag, last_modified)
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                add_validators(response, etag, last_modified)
+            return response
+
+        return decorated_function
+
+    return decorator
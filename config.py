@@ -0,0 +1,126 @@
+import json
+import os
+
+
+# Default settings, read from the environment. create_app() can override any of them.
+class Config:
+    SECRET_KEY = os.environ.get('FLASK_KEY')
+
+    SQLALCHEMY_DATABASE_URI = os.getenv("DB_URI", "sqlite:///posts.db")
+    # Connection pool and timeouts, used for the primary and the replica
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))  # seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # seconds before a connection is replaced
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+    DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", 5000))  # milliseconds
+    # Optional read replica for the read-only pages, writers stay on the primary for a few seconds after writing
+    DB_REPLICA_URI = os.getenv("DB_REPLICA_URI")
+    DB_REPLICA_STICKY_SECONDS = int(os.getenv("DB_REPLICA_STICKY_SECONDS", 10))
+
+    ARCHIVE_PAGE_SIZE = int(os.getenv("ARCHIVE_PAGE_SIZE", 10))  # posts per archive page
+    SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 10))  # results per search page
+    COMMENTS_PAGE_SIZE = int(os.getenv("COMMENTS_PAGE_SIZE", 20))  # comments per "load more"
+    EXCERPT_LENGTH = int(os.getenv("EXCERPT_LENGTH", 200))  # characters kept in a post excerpt
+    READING_WORDS_PER_MINUTE = int(os.getenv("READING_WORDS_PER_MINUTE", 200))
+    API_PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", 20))  # default ?limit= of the JSON API
+    API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", 100))
+    ASSETS_MAX_AGE = int(os.getenv("ASSETS_MAX_AGE", 31536000))  # fingerprinted static files never change
+    FEED_SIZE = int(os.getenv("FEED_SIZE", 20))  # latest posts in the Atom and RSS feeds
+    FEED_DIR = os.getenv("FEED_DIR")  # where the feeds and sitemap are built, shared by the workers
+    FEED_MAX_AGE = int(os.getenv("FEED_MAX_AGE", 300))  # seconds clients may reuse them without asking
+    FEED_SITEMAP_BATCH = int(os.getenv("FEED_SITEMAP_BATCH", 1000))  # rows fetched at a time for the sitemap
+    MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", 16 * 1024 * 1024))  # largest request body, e.g. uploads
+    QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "off")  # off, log or raise
+
+    # Uploaded post images and their resized variants (see images.py). IMAGE_WORKERS=0 resizes inline.
+    IMAGE_DIR = os.getenv("IMAGE_DIR")  # defaults to instance/images
+    IMAGE_WIDTHS = [int(w) for w in os.getenv("IMAGE_WIDTHS", "480,800,1200,1600,2000").split(",")]
+    IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 80))
+    IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 1))  # resizing processes per worker
+
+    # Request timing: Server-Timing headers and histograms at /metrics (see metrics.py)
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+    METRICS_SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "1") == "1"
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # bearer token for /metrics, which is off without it
+    METRICS_DIR = os.getenv("METRICS_DIR")  # shared by the gunicorn workers so /metrics covers all of them
+    METRICS_FLUSH_INTERVAL = int(os.getenv("METRICS_FLUSH_INTERVAL", 5))  # seconds
+    # cProfile a fraction of requests (0 = off), optionally only these comma separated endpoints
+    METRICS_PROFILE_RATE = float(os.getenv("METRICS_PROFILE_RATE", 0))
+    METRICS_PROFILE_ENDPOINTS = [e for e in os.getenv("METRICS_PROFILE_ENDPOINTS", "").split(",") if e]
+    METRICS_PROFILE_DIR = os.getenv("METRICS_PROFILE_DIR")
+
+    # Post views, counted per worker and written in batches (see viewcounts.py). A crash loses at most
+    # VIEW_FLUSH_INTERVAL seconds or VIEW_FLUSH_SIZE views per worker.
+    VIEW_COUNTS_ENABLED = os.getenv("VIEW_COUNTS_ENABLED", "1") == "1"
+    VIEW_FLUSH_INTERVAL = int(os.getenv("VIEW_FLUSH_INTERVAL", 30))  # seconds
+    VIEW_FLUSH_SIZE = int(os.getenv("VIEW_FLUSH_SIZE", 1000))  # views waiting before an early flush
+    POPULAR_POSTS_SIZE = int(os.getenv("POPULAR_POSTS_SIZE", 5))  # "most read this week" on the index
+    POPULAR_POSTS_DAYS = int(os.getenv("POPULAR_POSTS_DAYS", 7))
+    POPULAR_POSTS_TTL = int(os.getenv("POPULAR_POSTS_TTL", 300))  # seconds a worker reuses the list
+
+    # Comment avatars. With AVATAR_PROXY=1 they are fetched from AVATAR_BASE_URL once, resized and served
+    # from /avatar/<hash> out of a disk cache (see avatars.py); otherwise the pages link to Gravatar.
+    AVATAR_SIZE = int(os.getenv("AVATAR_SIZE", 100))
+    AVATAR_SIZES = [int(s) for s in os.getenv("AVATAR_SIZES", "100,200").split(",")]  # sizes the proxy serves
+    AVATAR_DEFAULT = os.getenv("AVATAR_DEFAULT", "retro")  # Gravatar's image for unknown emails, without the proxy
+    AVATAR_RATING = os.getenv("AVATAR_RATING", "g")
+    AVATAR_BASE_URL = os.getenv("AVATAR_BASE_URL", "https://secure.gravatar.com/avatar/")
+    AVATAR_PROXY = os.getenv("AVATAR_PROXY", "0") == "1"
+    AVATAR_DIR = os.getenv("AVATAR_DIR")  # defaults to instance/avatars
+    AVATAR_CACHE_SIZE = int(os.getenv("AVATAR_CACHE_SIZE", 5000))  # cached files before the oldest are evicted
+    AVATAR_TTL = int(os.getenv("AVATAR_TTL", 86400))  # seconds before an avatar is fetched again
+    AVATAR_RETRY_TTL = int(os.getenv("AVATAR_RETRY_TTL", 300))  # after a failed fetch
+    AVATAR_MAX_AGE = int(os.getenv("AVATAR_MAX_AGE", 86400))  # browser caching
+    AVATAR_FETCH_TIMEOUT = float(os.getenv("AVATAR_FETCH_TIMEOUT", 3))
+
+    # Rendered page cache: filesystem (shared between workers), memory (one copy per worker, only for a
+    # single process like the dev server) or null to turn it off. Invalidations always go through
+    # PAGE_CACHE_DIR (default instance/page_cache), so every worker and CLI command must see the same one.
+    PAGE_CACHE_BACKEND = os.getenv("PAGE_CACHE_BACKEND", "filesystem")
+    PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR")
+    PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", 300))
+    PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", 500))
+    PAGE_CACHE_GENERATIONS = int(os.getenv("PAGE_CACHE_GENERATIONS", 20000))  # tag generations kept, one per post
+
+    # Logged-in user identities, same backends as the page cache
+    USER_CACHE_BACKEND = os.getenv("USER_CACHE_BACKEND", "memory")
+    USER_CACHE_DIR = os.getenv("USER_CACHE_DIR")
+    USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 300))
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 1000))
+
+    # Token buckets for the write and mail endpoints (see ratelimit.py). The sqlite backend is shared by
+    # all workers on the machine. RATE_LIMITS is JSON overriding the defaults, e.g. {"login": {"ip": "5/minute"}}
+    RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+    RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory, sqlite or null
+    RATE_LIMIT_PATH = os.getenv("RATE_LIMIT_PATH")
+    RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", 0))  # proxies setting X-Forwarded-For
+    RATE_LIMITS = json.loads(os.getenv("RATE_LIMITS", "{}"))
+
+    # Password hashing policy, stored hashes below it are upgraded on the next login.
+    # PASSWORD_HASH_WORKERS=0 hashes inline in the request (handy for tests and the CLI).
+    PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+    PASSWORD_SALT_LENGTH = int(os.getenv("PASSWORD_SALT_LENGTH", 16))
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 1))  # hashing processes per worker
+    PASSWORD_HASH_NICE = int(os.getenv("PASSWORD_HASH_NICE", 10))  # lower priority than page serving
+    PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 4))
+    PASSWORD_HASH_WAIT = float(os.getenv("PASSWORD_HASH_WAIT", 0.5))  # seconds to wait for a slot
+    PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", 10))
+
+    # Outgoing mail, sent by the outbox worker ("flask outbox run") over one reused SMTP connection
+    MAIL_SERVER = os.getenv("MAIL_SERVER", "smtp.gmail.com")
+    MAIL_PORT = int(os.getenv("MAIL_PORT", 587))
+    MAIL_USE_TLS = os.getenv("MAIL_USE_TLS", "1") == "1"
+    MAIL_USERNAME = os.getenv("MY_MAIL_ADDRESS")
+    MAIL_PASSWORD = os.getenv("MAIL_APP_PW")
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 6))
+    OUTBOX_RETRY_DELAY = int(os.getenv("OUTBOX_RETRY_DELAY", 30))  # seconds, doubled on every retry
+    OUTBOX_LEASE = int(os.getenv("OUTBOX_LEASE", 300))  # seconds a worker may hold a claimed message
+
+    # New-post emails to the subscribers, sent by "flask mailings run" (see mailings.py)
+    MAILING_FROM = os.getenv("MAILING_FROM")  # defaults to MAIL_USERNAME
+    MAILING_CONNECTIONS = int(os.getenv("MAILING_CONNECTIONS", 2))  # SMTP connections used at once
+    MAILING_MESSAGES_PER_CONNECTION = int(os.getenv("MAILING_MESSAGES_PER_CONNECTION", 100))  # then log in again
+    MAILING_RATE = float(os.getenv("MAILING_RATE", 0))  # messages per second over all connections, 0 = no limit
+    MAILING_CHUNK_SIZE = int(os.getenv("MAILING_CHUNK_SIZE", 500))  # subscribers loaded and saved at a time
+    MAILING_LEASE = int(os.getenv("MAILING_LEASE", 600))  # seconds a mailer may hold a mailing between chunks
@@ -0,0 +1,155 @@
+from html import escape
+from html.parser import HTMLParser
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import func
+from models import BlogPost, Comment, db
+from cache import page_cache
+from search import rebuild_search_index
+import feeds
+import click
+import math
+import time
+
+# Tags and attributes CKEditor produces that we keep, everything else is dropped (its text is kept)
+ALLOWED_TAGS = {
+    "a", "abbr", "b", "blockquote", "br", "code", "em", "figcaption", "figure", "h1", "h2", "h3", "h4",
+    "h5", "h6", "hr", "i", "img", "li", "ol", "p", "pre", "s", "span", "strong", "sub", "sup", "table",
+    "tbody", "td", "th", "thead", "tr", "u", "ul",
+}
+ALLOWED_ATTRIBUTES = {
+    "a": {"href", "title"},
+    "img": {"src", "alt", "title", "width", "height"},
+    "td": {"colspan", "rowspan"},
+    "th": {"colspan", "rowspan"},
+}
+URL_ATTRIBUTES = {"href", "src"}
+SAFE_SCHEMES = ("http://", "https://", "mailto:", "/", "#")
+VOID_TAGS = {"br", "hr", "img"}
+# Dropped together with everything inside them
+DROP_CONTENT_TAGS = {"script", "style", "iframe", "object", "embed", "template"}
+BLOCK_TAGS = {"p", "br", "li", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "tr", "figcaption"}
+
+
+# Rebuilds the body from the parsed HTML: allowed tags only, quoted and escaped attributes,
+# every opened tag closed. The plain text is collected at the same time for the excerpt and word count.
+class BodyCleaner(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.html = []
+        self.text = []
+        self.open_tags = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self.skipping += 1
+            return
+        if self.skipping:
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append(" ")
+        if tag not in ALLOWED_TAGS:
+            return
+        kept = []
+        for name, value in attrs:
+            if name not in ALLOWED_ATTRIBUTES.get(tag, ()) or value is None:
+                continue
+            if name in URL_ATTRIBUTES and not value.strip().lower().startswith(SAFE_SCHEMES):
+                continue
+            kept.append(f' {name}="{escape(value)}"')
+        self.html.append(f"<{tag}{''.join(kept)}>")
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and self.open_tags and self.open_tags[-1] == tag:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.skipping = max(self.skipping - 1, 0)
+            return
+        if self.skipping or tag not in self.open_tags:
+            return
+        # Close anything left open inside this tag as well
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.html.append(f"</{open_tag}>")
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.skipping:
+            return
+        self.html.append(escape(data, quote=False))
+        self.text.append(data)
+
+    def result(self):
+        self.close()
+        while self.open_tags:
+            self.html.append(f"</{self.open_tags.pop()}>")
+        return "".join(self.html).strip(), " ".join("".join(self.text).split())
+
+
+def make_excerpt(text, length):
+    if len(text) <= length:
+        return text
+    return text[:length].rsplit(" ", 1)[0].rstrip(",.;:") + "…"
+
+
+# Fills in every column derived from the body. Called by add_new_post and edit_post before committing.
+def process_post(post):
+    cleaner = BodyCleaner()
+    cleaner.feed(post.body or "")
+    body_html, text = cleaner.result()
+    word_count = len(text.split())
+    post.body_html = body_html
+    post.body_text = text
+    post.excerpt = make_excerpt(text, current_app.config['EXCERPT_LENGTH'])
+    post.word_count = word_count
+    post.reading_time = max(1, math.ceil(word_count / current_app.config['READING_WORDS_PER_MINUTE']))
+
+
+posts_cli = AppGroup('posts', help="Maintenance commands for blog posts.")
+
+
+@posts_cli.command('reprocess')
+@click.option('--batch-size', default=200, help="Posts loaded and committed at a time.")
+def reprocess(batch_size):
+    """Rebuild the cleaned HTML, plain text, excerpt, word count, reading time and comment count of every post."""
+    comment_counts = (
+        db.select(func.count(Comment.id))
+        .where(Comment.post_id == BlogPost.id)
+        .scalar_subquery()
+    )
+    started = time.perf_counter()
+    last_id = 0
+    total = 0
+    while True:
+        posts = db.session.execute(
+            db.select(BlogPost).where(BlogPost.id > last_id).order_by(BlogPost.id).limit(batch_size)
+        ).scalars().all()
+        if not posts:
+            break
+        for post in posts:
+            process_post(post)
+        ids = [post.id for post in posts]
+        last_id = ids[-1]
+        db.session.execute(
+            db.update(BlogPost)
+            .where(BlogPost.id.in_(ids))
+            .values(comment_count=comment_counts)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        page_cache.invalidate(*[f"post:{post_id}" for post_id in ids])
+        # Start every batch with an empty session so memory stays flat
+        db.session.expunge_all()
+        total += len(ids)
+        click.echo(f"Processed {total} posts")
+    rebuild_search_index()
+    page_cache.invalidate("index", "archive")
+    feeds.invalidate()
+    click.echo(f"Done: {total} posts in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,74 @@
+from functools import wraps
+from flask import g, request, session, current_app, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+import time
+
+
+# Engine settings from the app config. Pool sizes only apply to server databases,
+# SQLite files don't benefit from a large pool.
+def engine_options(config, url):
+    options = {
+        "pool_pre_ping": config['DB_POOL_PRE_PING'],
+        "pool_recycle": config['DB_POOL_RECYCLE'],
+    }
+    if url.startswith("sqlite"):
+        # How long to wait for another writer's lock before giving up
+        options["connect_args"] = {"timeout": config['DB_STATEMENT_TIMEOUT'] / 1000}
+        return options
+    options.update(
+        pool_size=config['DB_POOL_SIZE'],
+        max_overflow=config['DB_MAX_OVERFLOW'],
+        pool_timeout=config['DB_POOL_TIMEOUT'],
+    )
+    if url.startswith("postgres"):
+        options["connect_args"] = {"options": f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT']}"}
+    return options
+
+
+# Session that sends the reads of @replica_reads views to the "replica" bind, if one is configured.
+# Anything flushing, or a session holding unsaved changes, stays on the primary.
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.use_replica():
+            return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def use_replica(self):
+        return (has_request_context() and g.get('read_replica', False)
+                and not self._flushing and not (self.new or self.dirty or self.deleted)
+                and 'replica' in self._db.engines)
+
+
+# A reader who just wrote something (e.g. posted a comment) reads from the primary for a while,
+# so they see their own write even if the replica is lagging behind.
+def wrote_recently():
+    return session.get('primary_until', 0) > time.time()
+
+
+# Decorator for views that only read: their GET requests may be served from the replica
+def replica_reads(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method in ('GET', 'HEAD') and not wrote_recently():
+            g.read_replica = True
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def mark_write(db_session, flush_context):
+    if has_request_context():
+        g.wrote_to_primary = True
+
+
+def stick_to_primary(response):
+    if g.get('wrote_to_primary'):
+        session['primary_until'] = time.time() + current_app.config['DB_REPLICA_STICKY_SECONDS']
+    return response
+
+
+def init_app(app):
+    if not event.contains(RoutingSession, 'after_flush', mark_write):
+        event.listen(RoutingSession, 'after_flush', mark_write)
+    app.after_request(stick_to_primary)
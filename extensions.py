@@ -0,0 +1,20 @@
+from flask_bootstrap import Bootstrap5
+from flask_ckeditor import CKEditor
+from flask_login import LoginManager
+from flask_migrate import Migrate
+from usercache import user_cache
+
+# Extensions are created here without an app and bound to one in create_app()
+
+ckeditor = CKEditor()
+bootstrap = Bootstrap5()
+migrate = Migrate()
+
+# Configure Flask-Login
+login_manager = LoginManager()
+
+
+# Served from the user cache, a deleted user gets None and is treated as logged out
+@login_manager.user_loader
+def load_user(user_id):
+    return user_cache.get(user_id)
@@ -0,0 +1,151 @@
+from datetime import timezone
+from email.utils import format_datetime
+from flask import current_app, send_file, url_for
+from sqlalchemy.orm import joinedload, load_only
+from xml.sax.saxutils import escape
+from models import BlogPost, User, db
+import os
+import tempfile
+import time
+
+# The Atom and RSS feeds and the sitemap are built into files and served from disk with ETag /
+# Last-Modified support. The admin routes call invalidate() when a post is created, edited or
+# deleted, which starts a new version; the files are rebuilt by the first request that wants them.
+
+BLOG_TITLE = "Lester's Blog"
+
+
+def feed_dir():
+    return current_app.config['FEED_DIR'] or os.path.join(current_app.instance_path, 'feeds')
+
+
+# Shared by every worker through the version file, a missing file starts a new version
+def current_version():
+    path = os.path.join(feed_dir(), 'version')
+    try:
+        with open(path) as f:
+            version = f.read().strip()
+        if version:
+            return version
+    except OSError:
+        pass
+    return invalidate()
+
+
+def invalidate():
+    directory = feed_dir()
+    os.makedirs(directory, exist_ok=True)
+    version = str(time.time_ns())
+    write_atomic(os.path.join(directory, 'version'), [version])
+    return version
+
+
+def write_atomic(path, chunks):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def remove_old_versions(directory, name, keep):
+    for entry in os.listdir(directory):
+        if entry.startswith(f"{name}.") and entry != keep and not entry.endswith('.tmp'):
+            try:
+                os.remove(os.path.join(directory, entry))
+            except OSError:
+                pass
+
+
+# Serves the artifact for the current version, building it first if no worker has yet.
+# The version is read before building, so a post saved during a build just starts another version.
+def serve(name, build, mimetype):
+    directory = feed_dir()
+    version = current_version()
+    filename = f"{name}.{version}"
+    path = os.path.join(directory, filename)
+    if not os.path.exists(path):
+        write_atomic(path, build())
+        remove_old_versions(directory, name, filename)
+    return send_file(path, mimetype=mimetype, conditional=True, etag=True,
+                     max_age=current_app.config['FEED_MAX_AGE'])
+
+
+def latest_posts():
+    return db.session.execute(
+        db.select(BlogPost)
+        .options(load_only(BlogPost.id, BlogPost.title, BlogPost.subtitle, BlogPost.date, BlogPost.updated_at,
+                           BlogPost.excerpt, BlogPost.body_html, BlogPost.author_id),
+                 joinedload(BlogPost.author).load_only(User.name))
+        .order_by(BlogPost.date.desc(), BlogPost.id.desc())
+        .limit(current_app.config['FEED_SIZE'])
+    ).scalars().all()
+
+
+def iso(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def build_atom():
+    posts = latest_posts()
+    home = url_for('views.get_all_posts', _external=True)
+    updated = max((post.updated_at for post in posts), default=None)
+    yield '<?xml version="1.0" encoding="utf-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom">\n'
+    yield f"<title>{escape(BLOG_TITLE)}</title>\n<id>{escape(home)}</id>\n"
+    yield f'<link href="{escape(home)}"/>\n<link rel="self" href="{escape(url_for("views.atom_feed", _external=True))}"/>\n'
+    if updated:
+        yield f"<updated>{iso(updated)}</updated>\n"
+    for post in posts:
+        link = escape(url_for('views.show_post', post_id=post.id, _external=True))
+        yield (
+            f"<entry>\n<title>{escape(post.title)}</title>\n<id>{link}</id>\n<link href=\"{link}\"/>\n"
+            f"<published>{iso(post.date)}</published>\n<updated>{iso(post.updated_at)}</updated>\n"
+            f"<author><name>{escape(post.author.name if post.author else '')}</name></author>\n"
+            f"<summary>{escape(post.excerpt or post.subtitle)}</summary>\n"
+            f"<content type=\"html\">{escape(post.body_html or '')}</content>\n</entry>\n"
+        )
+    yield "</feed>\n"
+
+
+def rfc822(value):
+    return format_datetime(value.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def build_rss():
+    posts = latest_posts()
+    home = url_for('views.get_all_posts', _external=True)
+    yield '<?xml version="1.0" encoding="utf-8"?>\n<rss version="2.0">\n<channel>\n'
+    yield (f"<title>{escape(BLOG_TITLE)}</title>\n<link>{escape(home)}</link>\n"
+           f"<description>{escape(BLOG_TITLE)}</description>\n")
+    if posts:
+        yield f"<lastBuildDate>{rfc822(max(post.updated_at for post in posts))}</lastBuildDate>\n"
+    for post in posts:
+        link = escape(url_for('views.show_post', post_id=post.id, _external=True))
+        yield (
+            f"<item>\n<title>{escape(post.title)}</title>\n<link>{link}</link>\n"
+            f"<guid isPermaLink=\"true\">{link}</guid>\n<pubDate>{rfc822(post.date)}</pubDate>\n"
+            f"<description>{escape(post.excerpt or post.subtitle)}</description>\n</item>\n"
+        )
+    yield "</channel>\n</rss>\n"
+
+
+# Streams every post id straight from the cursor, so memory use does not grow with the number of posts
+def build_sitemap():
+    yield '<?xml version="1.0" encoding="utf-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    for endpoint in ('views.get_all_posts', 'views.blog_archive', 'views.about'):
+        yield f"<url><loc>{escape(url_for(endpoint, _external=True))}</loc></url>\n"
+    rows = db.session.execute(
+        db.select(BlogPost.id, BlogPost.updated_at).order_by(BlogPost.id)
+        .execution_options(yield_per=current_app.config['FEED_SITEMAP_BATCH'])
+    )
+    for post_id, updated_at in rows:
+        loc = escape(url_for('views.show_post', post_id=post_id, _external=True))
+        yield f"<url><loc>{loc}</loc><lastmod>{updated_at.strftime('%Y-%m-%d')}</lastmod></url>\n"
+    yield "</urlset>\n"
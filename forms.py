@@ -1,6 +1,7 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField, PasswordField, TextAreaField
-from wtforms.validators import DataRequired, URL, Length, Email
+from wtforms import StringField, SubmitField, PasswordField, TextAreaField, BooleanField
+from wtforms.validators import DataRequired, URL, Length, Email, Optional
+from flask_wtf.file import FileField, FileAllowed
 from flask_ckeditor import CKEditorField
 
 
@@ -8,16 +9,28 @@ from flask_ckeditor import CKEditorField
 class CreatePostForm(FlaskForm):
     title = StringField("Blog Post Title", validators=[DataRequired()])
     subtitle = StringField("Subtitle", validators=[DataRequired()])
-    img_url = StringField("Blog Image URL", validators=[DataRequired(), URL()])
+    img_url = StringField("Blog Image URL", validators=[Optional(), URL(require_tld=False)])
+    image = FileField("Or upload an image", validators=[FileAllowed(["jpg", "jpeg", "png", "webp", "gif"],
+                                                                   "Only JPEG, PNG, WebP or GIF images.")])
     body = CKEditorField("Blog Content", validators=[DataRequired()])
     submit = SubmitField("Submit Post")
 
+    # A post needs an image, either a link or an upload
+    def validate(self, extra_validators=None):
+        if not super().validate(extra_validators):
+            return False
+        if not self.img_url.data and not self.image.data:
+            self.img_url.errors.append("Enter an image URL or upload an image.")
+            return False
+        return True
+
 
 # Create a form to register new users
 class RegisterForm(FlaskForm):
     email = StringField("Email", validators=[DataRequired(), Email()])
     password = PasswordField("Password", validators=[DataRequired()])
     name = StringField("Name", validators=[DataRequired()])
+    subscribe = BooleanField("Email me when there is a new post")
     submit = SubmitField("Sign Me Up!")
 
 
@@ -45,3 +58,7 @@ class ResetPasswordForm(FlaskForm):
     confirm_password = PasswordField("Confirm Password", validators=[DataRequired()])
     submit = SubmitField("Reset Password")
 
+
+# Switches the new-post emails on or off, the route sets the button label
+class SubscriptionForm(FlaskForm):
+    submit = SubmitField("Subscribe")
@@ -0,0 +1,310 @@
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app, request, send_file, url_for, abort
+from flask.cli import AppGroup
+from urllib.parse import urljoin, urlparse
+from werkzeug.security import safe_join
+from models import BlogPost, Image, db, utcnow
+from cache import page_cache
+import base64
+import click
+import hashlib
+import io
+import logging
+import os
+import posixpath
+import tempfile
+import threading
+
+try:
+    from PIL import Image as PILImage, ImageFilter, ImageOps
+except ImportError:  # optional, uploads are refused without it
+    PILImage = None
+
+# Uploaded post images. The original is stored under its sha256, so uploading the same file twice
+# stores it once, and a process pool writes WebP and JPEG copies at a few widths next to it plus a
+# tiny blurred placeholder. The post page shows the placeholder straight away and lets the browser
+# pick the variant that fits the screen from a srcset:
+#
+#   instance/images/3f/3fa9.../original.jpg
+#                              480.webp  480.jpg  800.webp  800.jpg ...
+#
+# The names never change content, so /media/ is served with a one-year immutable Cache-Control.
+
+FORMATS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'GIF': '.gif'}
+PLACEHOLDER_WIDTH = 16
+
+logger = logging.getLogger(__name__)
+
+images_cli = AppGroup('images', help="Process the uploaded post images.")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _lower_priority(niceness):
+    os.nice(niceness)
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Resizing is CPU heavy, keep it behind the page-serving workers
+            _pool = ProcessPoolExecutor(max_workers=current_app.config['IMAGE_WORKERS'],
+                                        initializer=_lower_priority, initargs=(10,))
+    return _pool
+
+
+def image_root(app):
+    return app.config['IMAGE_DIR'] or os.path.join(app.instance_path, 'images')
+
+
+def image_path(image_hash):
+    return f"{image_hash[:2]}/{image_hash}"
+
+
+def write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+# Checks the file really is an image and stores it, returns its Image row (added to the session,
+# not committed). Raises ValueError for anything Pillow cannot read.
+def store_image(data):
+    if PILImage is None:
+        raise ValueError("Image uploads need Pillow installed.")
+    try:
+        with PILImage.open(io.BytesIO(data)) as im:
+            ext = FORMATS.get(im.format)
+            im.verify()
+    except Exception:
+        raise ValueError("The file is not an image that can be read.")
+    if ext is None:
+        raise ValueError("Only JPEG, PNG, WebP or GIF images.")
+
+    image_hash = hashlib.sha256(data).hexdigest()
+    image = db.session.execute(db.select(Image).where(Image.hash == image_hash)).scalar()
+    if image is None:
+        image = Image(hash=image_hash, ext=ext, status="pending")
+        db.session.add(image)
+    directory = os.path.join(image_root(current_app), image_path(image_hash))
+    original = os.path.join(directory, f"original{image.ext}")
+    if not os.path.exists(original):
+        os.makedirs(directory, exist_ok=True)
+        write_atomic(original, data)
+    return image
+
+
+def save_upload(storage):
+    return store_image(storage.read())
+
+
+# Runs in the pool: writes the variants of one image and returns what the Image row needs.
+# Never upscales, an image narrower than every width gets a single variant at its own width.
+def make_variants(directory, ext, widths, quality):
+    with PILImage.open(os.path.join(directory, f"original{ext}")) as im:
+        width, height = im.size
+        sideways = im.getexif().get(0x0112, 1) in (5, 6, 7, 8)  # stored on its side
+        if sideways:
+            width, height = height, width
+        # Lets the JPEG decoder skip detail the largest variant does not need. The box is in the
+        # stored orientation, before exif_transpose turns the image upright.
+        box = (max(widths), max(widths) * height // width)
+        im.draft('RGB', box[::-1] if sideways else box)
+        im = ImageOps.exif_transpose(im)
+        if im.mode in ('RGBA', 'LA', 'P'):
+            im = im.convert('RGBA')
+            flat = PILImage.new('RGB', im.size, (255, 255, 255))
+            flat.paste(im, mask=im.getchannel('A'))
+        else:
+            im = flat = im.convert('RGB')
+
+        written = []
+        for target in sorted(min(w, im.width) for w in widths):
+            if target in written:
+                continue
+            size = (target, max(1, round(im.height * target / im.width)))
+            for source, name, fmt, options in (
+                (im, f"{target}.webp", 'WEBP', {'quality': quality, 'method': 4}),
+                (flat, f"{target}.jpg", 'JPEG', {'quality': quality, 'optimize': True, 'progressive': True}),
+            ):
+                resized = source if size == source.size else source.resize(size, PILImage.LANCZOS)
+                buffer = io.BytesIO()
+                resized.save(buffer, fmt, **options)
+                write_atomic(os.path.join(directory, name), buffer.getvalue())
+            written.append(target)
+
+        tiny = flat.resize((PLACEHOLDER_WIDTH, max(1, round(flat.height * PLACEHOLDER_WIDTH / flat.width))),
+                           PILImage.BILINEAR).filter(ImageFilter.GaussianBlur(1))
+        buffer = io.BytesIO()
+        tiny.save(buffer, 'JPEG', quality=50)
+    placeholder = "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+    return width, height, written, placeholder
+
+
+def variant_args(app, image):
+    return (os.path.join(image_root(app), image_path(image.hash)), image.ext,
+            app.config['IMAGE_WIDTHS'], app.config['IMAGE_QUALITY'])
+
+
+def apply_result(image, result):
+    image.width, image.height, widths, image.placeholder = result
+    image.widths = ",".join(str(w) for w in widths)
+    image.status = "ready"
+
+
+# The pages of the posts using the image change, so their ETags and cached copies have to go
+def touch_posts(image_ids):
+    post_ids = db.session.execute(db.select(BlogPost.id).where(BlogPost.image_id.in_(image_ids))).scalars().all()
+    if post_ids:
+        db.session.execute(db.update(BlogPost).where(BlogPost.id.in_(post_ids)).values(updated_at=utcnow()))
+    return post_ids
+
+
+def finish(app, image_id, future):
+    with app.app_context():
+        image = db.session.get(Image, image_id)
+        try:
+            apply_result(image, future.result())
+        except Exception:
+            logger.exception("Could not resize image %s", image.hash)
+            image.status = "failed"
+        post_ids = touch_posts([image_id])
+        db.session.commit()
+        page_cache.invalidate(*[f"post:{post_id}" for post_id in post_ids])
+
+
+# Called after the post using the image is committed. The variants are written in the background
+# and the post page shows the original until they are ready.
+def schedule(image):
+    if image.status != "pending":
+        return
+    app = current_app._get_current_object()
+    if not app.config['IMAGE_WORKERS']:
+        try:
+            apply_result(image, make_variants(*variant_args(app, image)))
+        except Exception:
+            logger.exception("Could not resize image %s", image.hash)
+            image.status = "failed"
+        touch_posts([image.id])
+        db.session.commit()
+        return
+    future = get_pool().submit(make_variants, *variant_args(app, image))
+    future.add_done_callback(lambda f: finish(app, image.id, f))
+
+
+# Template helpers
+def media_url(image, name):
+    return url_for('media', filename=f"{image_path(image.hash)}/{name}")
+
+
+# Stored in BlogPost.img_url. Kept relative so a new domain, a proxy or an export doesn't carry the
+# host of the request that uploaded it; absolute_url() adds it where a full URL is needed.
+def original_url(image):
+    return media_url(image, f"original{image.ext}")
+
+
+def absolute_url(url):
+    return urljoin(request.host_url, url) if url else url
+
+
+def image_srcset(image, ext):
+    return ", ".join(f"{media_url(image, f'{w}.{ext}')} {w}w" for w in image.widths.split(","))
+
+
+def image_src(image, ext):
+    return media_url(image, f"{image.widths.rsplit(',', 1)[-1]}.{ext}")
+
+
+def serve_media(filename):
+    path = safe_join(image_root(current_app), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    response = send_file(path, max_age=current_app.config['ASSETS_MAX_AGE'], conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+# The file behind an img_url that points at this site: /static/..., ../static/... or /media/...,
+# relative or on one of the given hosts
+def local_file(app, url, hosts):
+    parsed = urlparse(url)
+    if parsed.netloc and parsed.netloc not in hosts:
+        return None
+    path = posixpath.normpath("/" + parsed.path.lstrip("./"))
+    for prefix, root in ((app.static_url_path, app.static_folder), ("/media", image_root(app))):
+        if path.startswith(prefix + "/"):
+            return safe_join(root, path[len(prefix) + 1:])
+    return None
+
+
+def process_images(images, workers):
+    app = current_app._get_current_object()
+    done = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [(image, pool.submit(make_variants, *variant_args(app, image))) for image in images]
+        for image, future in futures:
+            try:
+                apply_result(image, future.result())
+                done += 1
+            except Exception as e:
+                click.echo(f"Could not resize {image.hash}: {e}", err=True)
+                image.status = "failed"
+                failed += 1
+    post_ids = touch_posts([image.id for image in images]) if images else []
+    db.session.commit()
+    page_cache.invalidate(*[f"post:{post_id}" for post_id in post_ids])
+    return done, failed
+
+
+@images_cli.command('process')
+@click.option('--all', 'everything', is_flag=True, help="Redo every image, e.g. after changing IMAGE_WIDTHS.")
+@click.option('--workers', default=os.cpu_count() or 1, help="Resizing processes.")
+def process(everything, workers):
+    """Write the variants of the images that are still pending or failed."""
+    query = db.select(Image)
+    if not everything:
+        query = query.where(Image.status != "ready")
+    images = db.session.execute(query.order_by(Image.id)).scalars().all()
+    done, failed = process_images(images, workers)
+    click.echo(f"Processed {done} images, {failed} failed")
+
+
+@images_cli.command('import-local')
+@click.option('--host', 'hosts', multiple=True, help="This site's host name, for absolute img_urls. Repeatable.")
+@click.option('--workers', default=os.cpu_count() or 1, help="Resizing processes.")
+def import_local(hosts, workers):
+    """Store the images of posts whose img_url points at a file on this site and write their variants."""
+    posts = db.session.execute(db.select(BlogPost).where(BlogPost.image_id.is_(None))).scalars().all()
+    linked = skipped = 0
+    for post in posts:
+        path = local_file(current_app, post.img_url, hosts)
+        if path is None or not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            try:
+                post.image = store_image(f.read())
+            except ValueError as e:
+                click.echo(f"Post {post.id}: {e}", err=True)
+                skipped += 1
+                continue
+        db.session.flush()
+        linked += 1
+    db.session.commit()
+    images = db.session.execute(db.select(Image).where(Image.status == "pending")).scalars().all()
+    done, failed = process_images(images, workers)
+    click.echo(f"Linked {linked} posts to local images ({skipped} skipped), processed {done}, {failed} failed")
+
+
+def init_app(app):
+    app.add_url_rule("/media/<path:filename>", 'media', serve_media)
+    app.jinja_env.globals['image_srcset'] = image_srcset
+    app.jinja_env.globals['image_src'] = image_src
@@ -0,0 +1,255 @@
+from datetime import timedelta
+from email.header import Header
+from email.utils import formataddr, formatdate, make_msgid
+from flask import current_app, render_template, request, url_for
+from flask.cli import AppGroup
+from models import BlogPost, Mailing, OutboxMessage, User, db, utcnow
+from outbox import SMTPSender, is_permanent
+import click
+import logging
+import queue
+import quopri
+import smtplib
+import threading
+import time
+
+# New-post emails to the subscribers. Publishing a post only adds a row to mailings; the mailer
+# ("flask mailings run") walks the subscribed users in chunks of MAILING_CHUNK_SIZE and hands the
+# messages to MAILING_CONNECTIONS threads, each with its own logged-in SMTP connection that is
+# reused for up to MAILING_MESSAGES_PER_CONNECTION messages. MAILING_RATE caps the messages per
+# second over all connections to stay inside the provider's limits.
+#
+# The email is rendered once per mailing; only the recipient's name, address and unsubscribe link
+# are filled in per message. Progress is saved after every chunk, so a mailer that is stopped or
+# dies carries on after the last finished chunk (those in-flight recipients may get the email twice).
+# Messages the server refuses for now (4xx, dropped connections) go to the outbox, which retries
+# them with backoff; permanent refusals are only counted.
+
+logger = logging.getLogger(__name__)
+
+mailings_cli = AppGroup('mailings', help="Email new posts to the subscribers.")
+
+# Filled in per recipient, control characters never appear in a rendered post
+NAME = "\x00name\x00"
+UNSUBSCRIBE_URL = "\x00unsubscribe\x00"
+
+
+# Called by add_new_post, in the same transaction as the post
+def queue_mailing(post):
+    db.session.add(Mailing(post=post, base_url=request.url_root))
+
+
+class MessageTemplate:
+    def __init__(self, from_addr, subject, text):
+        self.from_addr = from_addr
+        self.domain = from_addr.rpartition("@")[2] or "localhost"
+        self.headers = (f"From: {from_addr}\n"
+                        f"Subject: {subject if subject.isascii() else Header(subject, 'utf-8').encode()}\n"
+                        "MIME-Version: 1.0\n"
+                        "Content-Type: text/plain; charset=utf-8\n"
+                        "Content-Transfer-Encoding: quoted-printable\n")
+        self.text = text
+
+    def render(self, to_addr, name, unsubscribe_url):
+        body = self.text.replace(NAME, name).replace(UNSUBSCRIBE_URL, unsubscribe_url)
+        # make_msgid would look up this machine's FQDN for every message without the domain
+        return (f"{self.headers}"
+                f"To: {formataddr((name, to_addr), 'utf-8')}\n"
+                f"Date: {formatdate()}\n"
+                f"Message-ID: {make_msgid(domain=self.domain)}\n"
+                f"List-Unsubscribe: <{unsubscribe_url}>\n"
+                "List-Unsubscribe-Post: List-Unsubscribe=One-Click\n\n"
+                + quopri.encodestring(body.encode('utf-8')).decode('ascii'))
+
+
+# Worth another try later: the server was unavailable or refused for now (4xx)
+def retryable(error):
+    return isinstance(error, (smtplib.SMTPException, OSError)) and not is_permanent(error)
+
+
+# Spaces the messages of all connections MAILING_RATE per second apart, 0 means no limit
+class Throttle:
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# A few SMTP connections, each used by one thread. send_all() blocks until a chunk is done and
+# returns (user_id, to_addr, message, error) for every message, error None when it was accepted.
+class ConnectionPool:
+    def __init__(self, sender_factory, connections, per_connection, throttle):
+        self.sender_factory = sender_factory
+        self.per_connection = per_connection
+        self.throttle = throttle
+        self.jobs = queue.Queue()
+        self.results = []
+        self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(connections)]
+        for thread in self.threads:
+            thread.start()
+
+    def work(self):
+        sender = self.sender_factory()
+        used = 0
+        try:
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    break
+                user_id, from_addr, to_addr, message = job
+                # A fresh login every so often, providers cap the messages per connection
+                if used >= self.per_connection:
+                    sender.close()
+                    used = 0
+                self.throttle.wait()
+                try:
+                    sender.send(from_addr, to_addr, message)
+                    used += 1
+                    error = None
+                except Exception as e:
+                    error = e
+                    if retryable(e):
+                        sender.close()
+                        used = 0
+                self.results.append((user_id, to_addr, message, error))
+                self.jobs.task_done()
+        finally:
+            sender.close()
+
+    def send_all(self, jobs):
+        self.results = []
+        for job in jobs:
+            self.jobs.put(job)
+        self.jobs.join()
+        return self.results
+
+    def close(self):
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+def claim_mailing(lease):
+    now = utcnow()
+    mailing = db.session.execute(
+        db.select(Mailing)
+        .where(Mailing.status.in_(["pending", "sending"]), Mailing.locked_until <= now)
+        .order_by(Mailing.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).scalar()
+    if mailing is not None:
+        mailing.status = "sending"
+        mailing.locked_until = now + timedelta(seconds=lease)
+        db.session.commit()
+    return mailing
+
+
+def subscribers(after_id, chunk_size):
+    return db.session.execute(
+        db.select(User.id, User.email, User.name)
+        .where(User.subscribed.is_(True), User.id > after_id)
+        .order_by(User.id)
+        .limit(chunk_size)
+    ).all()
+
+
+def send_mailing(mailing, sender_factory=None):
+    config = current_app.config
+    from_addr = config['MAILING_FROM'] or config['MAIL_USERNAME']
+    sender_factory = sender_factory or (lambda: SMTPSender.from_config(config))
+    post = db.session.get(BlogPost, mailing.post_id)
+    if post is None:  # deleted before it was mailed
+        mailing.status = "done"
+        mailing.finished_at = utcnow()
+        db.session.commit()
+        return mailing
+    with current_app.test_request_context(base_url=mailing.base_url):
+        template = MessageTemplate(from_addr, f"New post: {post.title}", render_template(
+            "email/new-post.txt", post=post, name=NAME, unsubscribe_url=UNSUBSCRIBE_URL,
+            post_url=url_for('views.show_post', post_id=post.id, _external=True)))
+        pool = ConnectionPool(sender_factory, config['MAILING_CONNECTIONS'],
+                              config['MAILING_MESSAGES_PER_CONNECTION'], Throttle(config['MAILING_RATE']))
+        try:
+            while True:
+                users = subscribers(mailing.last_user_id, config['MAILING_CHUNK_SIZE'])
+                if not users:
+                    break
+                jobs = [(user.id, from_addr, user.email, template.render(
+                    user.email, user.name or "", url_for('views.unsubscribe', token=User.unsubscribe_token(user.id),
+                                                         _external=True)))
+                        for user in users]
+                results = pool.send_all(jobs)
+                if all(error is not None and retryable(error) for *_, error in results):
+                    # Nothing got through, the server is down: keep the chunk and try again later
+                    logger.error("Mailing %s paused, SMTP unavailable: %r", mailing.id, results[0][3])
+                    mailing.locked_until = utcnow() + timedelta(seconds=config['OUTBOX_RETRY_DELAY'])
+                    db.session.commit()
+                    return mailing
+                for user_id, to_addr, message, error in results:
+                    if error is None:
+                        mailing.sent += 1
+                    elif retryable(error):
+                        db.session.add(OutboxMessage(from_addr=from_addr, to_addr=to_addr, message=message,
+                                                     attempts=1, last_error=repr(error)))
+                        mailing.deferred += 1
+                    else:
+                        logger.warning("Mailing %s to user %s refused: %r", mailing.id, user_id, error)
+                        mailing.failed += 1
+                mailing.last_user_id = users[-1].id
+                mailing.locked_until = utcnow() + timedelta(seconds=config['MAILING_LEASE'])
+                db.session.commit()
+        finally:
+            pool.close()
+    mailing.status = "done"
+    mailing.finished_at = utcnow()
+    db.session.commit()
+    return mailing
+
+
+def report(mailing):
+    click.echo(f"Mailing {mailing.id} (post {mailing.post_id}): {mailing.status}, {mailing.sent} sent, "
+               f"{mailing.deferred} deferred, {mailing.failed} failed, last user {mailing.last_user_id}")
+
+
+@mailings_cli.command('run')
+@click.option('--poll-interval', default=30.0, help="Seconds to wait when there is nothing to send.")
+def run_mailer(poll_interval):
+    """Keep sending new-post emails until stopped."""
+    while True:
+        mailing = claim_mailing(current_app.config['MAILING_LEASE'])
+        if mailing is None:
+            time.sleep(poll_interval)
+            continue
+        report(send_mailing(mailing))
+
+
+@mailings_cli.command('send')
+def send_pending():
+    """Send every pending (or interrupted) mailing, then exit."""
+    while True:
+        mailing = claim_mailing(current_app.config['MAILING_LEASE'])
+        if mailing is None:
+            break
+        started = time.perf_counter()
+        report(send_mailing(mailing))
+        click.echo(f"  in {time.perf_counter() - started:.1f}s")
+
+
+@mailings_cli.command('status')
+@click.option('--limit', default=10)
+def status(limit):
+    """Show the latest mailings and how far they got."""
+    for mailing in db.session.execute(db.select(Mailing).order_by(Mailing.id.desc()).limit(limit)).scalars():
+        report(mailing)
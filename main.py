@@ -1,50 +1,92 @@
 from flask import Flask
-from flask_bootstrap import Bootstrap5
-from flask_ckeditor import CKEditor
-from flask_gravatar import Gravatar
-from flask_login import LoginManager
+from flask.cli import with_appcontext
+from flask_migrate import stamp
+from config import Config
+from extensions import ckeditor, bootstrap, migrate, login_manager
 from routes import views
-from models import User, db
-import os
+from api import api
+from models import db
+from cache import page_cache
+from outbox import outbox_cli
+from mailings import mailings_cli
+from content import posts_cli
+from passwords import passwords_cli
+from transfer import data_cli
+from prerender import prerender_cli
+from assets import assets_cli
+from images import images_cli
+from usercache import user_cache
+from ratelimit import rate_limiter
+from viewcounts import view_counter
+import click
+import assets
+import avatars
+import dbrouting
+import images
+import metrics
+import querycount
+import search
 
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.environ.get('FLASK_KEY')
-ckeditor = CKEditor(app)
-Bootstrap5(app)
+# Builds the app. Nothing touches the database here: the schema is managed with
+# "flask create-db" for a new database and "flask db upgrade" for an existing one.
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if isinstance(config, dict):
+        app.config.from_mapping(config)
+    elif config is not None:
+        app.config.from_object(config)
 
-# Configure Flask-Login
-login_manager = LoginManager()
-login_manager.init_app(app)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                          dbrouting.engine_options(app.config, app.config['SQLALCHEMY_DATABASE_URI']))
+    if app.config['DB_REPLICA_URI']:
+        app.config.setdefault('SQLALCHEMY_BINDS', {
+            'replica': dict(dbrouting.engine_options(app.config, app.config['DB_REPLICA_URI']),
+                            url=app.config['DB_REPLICA_URI']),
+        })
 
+    ckeditor.init_app(app)
+    bootstrap.init_app(app)
+    login_manager.init_app(app)
+    avatars.init_app(app)  # the "avatar" filter and, with AVATAR_PROXY, /avatar/<hash>
+    app.jinja_env.filters['avatar'] = metrics.timed('avatar')(avatars.avatar_url)
+    assets.init_app(app)  # asset_url() for the fingerprinted static files
+    images.init_app(app)  # /media/ for the uploaded post images
 
-@login_manager.user_loader
-def load_user(user_id):
-    return db.get_or_404(User, user_id)
+    db.init_app(app)
+    dbrouting.init_app(app)
+    migrate.init_app(app, db, include_object=search.include_object)  # schema changes live in migrations/
+    querycount.init_app(app)
+    metrics.init_app(app)
+    page_cache.init_app(app)
+    user_cache.init_app(app)
+    rate_limiter.init_app(app)
+    view_counter.init_app(app)
 
+    app.cli.add_command(create_db)
+    app.cli.add_command(outbox_cli)
+    app.cli.add_command(mailings_cli)
+    app.cli.add_command(posts_cli)
+    app.cli.add_command(passwords_cli)
+    app.cli.add_command(data_cli)
+    app.cli.add_command(prerender_cli)
+    app.cli.add_command(assets_cli)
+    app.cli.add_command(images_cli)
 
-# For adding profile images to the comment section
-gravatar = Gravatar(app,
-                    size=100,
-                    rating='g',
-                    default='retro',
-                    force_default=False,
-                    force_lower=False,
-                    use_ssl=False,
-                    base_url=None)
+    app.register_blueprint(views)  # register the views from routes
+    app.register_blueprint(api)  # read-only JSON API under /api/v1
+    return app
 
-app.jinja_env.globals['gravatar'] = gravatar  # make gravatar global to templates
 
-
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DB_URI", "sqlite:///posts.db")
-db.init_app(app)
-
-
-with app.app_context():
+@click.command('create-db')
+@with_appcontext
+def create_db():
+    """Create the tables in a new, empty database and mark it as up to date with the migrations."""
     db.create_all()
+    stamp()
+    click.echo("Database created.")
 
 
-app.register_blueprint(views)  # register the views from routes
-
 if __name__ == "__main__":
-    app.run(debug=False, port=5001)
+    create_app().run(debug=False, port=5001)
@@ -0,0 +1,304 @@
+from bisect import bisect_left
+from functools import wraps
+from flask import g, request, current_app, has_request_context, abort, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import cProfile
+import hmac
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+# Per-request timing of the database, templates, avatar links and mail, sent back in a
+# Server-Timing header and collected into per-endpoint histograms served at /metrics.
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "blog_request_seconds": "Time spent handling a request.",
+    "blog_db_seconds": "Time spent in SQL statements per request.",
+    "blog_template_seconds": "Time spent rendering templates per request.",
+    "blog_avatar_seconds": "Time spent building avatar links per request.",
+    "blog_mail_seconds": "Time spent queueing email per request.",
+    "blog_db_queries_total": "SQL statements run.",
+    "blog_requests_total": "Requests handled.",
+}
+
+
+def add_time(name, seconds, count=1):
+    entry = g.timings.setdefault(name, [0.0, 0])
+    entry[0] += seconds
+    entry[1] += count
+
+
+def timing():
+    return has_request_context() and 'timings' in g
+
+
+# Decorator that adds the time spent in a function to the current request, e.g. timed("mail")
+def timed(name):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not timing():
+                return f(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                add_time(name, time.perf_counter() - started)
+
+        return decorated_function
+
+    return decorator
+
+
+def before_cursor(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_started = time.perf_counter()
+
+
+def after_cursor(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'metrics_started', None)
+    if started is not None and timing():
+        add_time('db', time.perf_counter() - started)
+
+
+def before_template(sender, template, context, **extra):
+    if timing():
+        g.template_started.append(time.perf_counter())
+
+
+def after_template(sender, template, context, **extra):
+    if timing() and g.template_started:
+        add_time('template', time.perf_counter() - g.template_started.pop())
+
+
+# Histograms and counters for this process. With METRICS_DIR set every gunicorn worker writes its
+# numbers there every few seconds and /metrics adds them all up.
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (name, labels) -> [count per bucket and +Inf..., sum]
+        self.counters = {}  # (name, labels) -> value
+        self.last_flush = 0
+
+    def observe(self, name, labels, seconds):
+        with self.lock:
+            values = self.histograms.get((name, labels))
+            if values is None:
+                values = self.histograms[(name, labels)] = [0] * (len(BUCKETS) + 1) + [0.0]
+            values[bisect_left(BUCKETS, seconds)] += 1
+            values[-1] += seconds
+
+    def inc(self, name, labels, amount=1):
+        with self.lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "histograms": [[name, labels, list(values)] for (name, labels), values in self.histograms.items()],
+                "counters": [[name, labels, value] for (name, labels), value in self.counters.items()],
+            }
+
+    def flush(self, directory, interval):
+        now = time.monotonic()
+        if now - self.last_flush < interval:
+            return
+        self.last_flush = now
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp, os.path.join(directory, f"{os.getpid()}.json"))
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# Snapshots of workers that have exited (restarted after max_requests, crashed, replaced by a deploy)
+# are deleted rather than added up forever; the totals then drop, which scrapers read as a counter reset
+def load_snapshots(directory):
+    snapshots = []
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        pid = name[:-len('.json')]
+        if pid.isdigit() and not process_exists(int(pid)):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels, extra=()):
+    pairs = [f'{key}="{escape_label(value)}"' for key, value in list(labels) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# Prometheus text format, version 0.0.4
+def render(snapshots):
+    histograms = {}
+    counters = {}
+    for snapshot in snapshots:
+        for name, labels, values in snapshot["histograms"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            total = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+
+    lines = []
+    for name in sorted({name for name, _ in histograms}):
+        lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} histogram"]
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), values[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {values[-1]}")
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+    for name in sorted({name for name, _ in counters}):
+        lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} counter"]
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def start_request():
+    g.timings = {}
+    g.template_started = []
+    g.request_started = time.perf_counter()
+    config = current_app.config
+    token = config['METRICS_TOKEN']
+    # Full cProfile capture for a sample of requests, or for one request asked for with the token
+    requested = token and hmac.compare_digest(request.headers.get('X-Profile', ''), token)
+    endpoints = config['METRICS_PROFILE_ENDPOINTS']
+    sampled = (config['METRICS_PROFILE_RATE'] and random.random() < config['METRICS_PROFILE_RATE']
+               and (not endpoints or request.endpoint in endpoints))
+    if requested or sampled:
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def stop_profiler():
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return None
+    profiler.disable()
+    directory = current_app.config['METRICS_PROFILE_DIR'] or os.path.join(current_app.instance_path, 'profiles')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{request.endpoint or 'none'}-{time.time_ns()}.prof")
+    profiler.dump_stats(path)
+    return os.path.basename(path)
+
+
+def finish_request(response):
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.pop('request_started')
+    timings = g.pop('timings')
+    profile = stop_profiler()
+
+    if current_app.config['METRICS_SERVER_TIMING']:
+        entries = []
+        for name, (seconds, count) in timings.items():
+            description = f';desc="{count} queries"' if name == 'db' else ''
+            entries.append(f"{name};dur={seconds * 1000:.2f}{description}")
+        if profile:
+            entries.append(f'profile;desc="{profile}"')
+        entries.append(f"total;dur={elapsed * 1000:.2f}")
+        response.headers.add('Server-Timing', ", ".join(entries))
+
+    labels = (('endpoint', request.endpoint or 'none'),)
+    registry.observe('blog_request_seconds', labels, elapsed)
+    for name, (seconds, count) in timings.items():
+        registry.observe(f'blog_{name}_seconds', labels, seconds)
+    registry.inc('blog_db_queries_total', labels, timings.get('db', (0, 0))[1])
+    registry.inc('blog_requests_total', labels + (('status', str(response.status_code)),))
+    if current_app.config['METRICS_DIR']:
+        registry.flush(current_app.config['METRICS_DIR'], current_app.config['METRICS_FLUSH_INTERVAL'])
+    return response
+
+
+# A request that failed before after_request ran still has to switch its profiler off
+def teardown(exc):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+
+
+# Needs the METRICS_TOKEN as a bearer token. Behind a proxy every request looks local, so the
+# address is never trusted and without a token there is no /metrics at all.
+def metrics_view():
+    token = current_app.config['METRICS_TOKEN']
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        abort(403)
+    directory = current_app.config['METRICS_DIR']
+    if directory:
+        registry.flush(directory, 0)
+        snapshots = load_snapshots(directory)
+    else:
+        snapshots = [registry.snapshot()]
+    return current_app.response_class(render(snapshots), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_app(app):
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('METRICS_SERVER_TIMING', True)
+    app.config.setdefault('METRICS_TOKEN', None)
+    app.config.setdefault('METRICS_DIR', None)
+    app.config.setdefault('METRICS_FLUSH_INTERVAL', 5)
+    app.config.setdefault('METRICS_PROFILE_RATE', 0.0)
+    app.config.setdefault('METRICS_PROFILE_ENDPOINTS', [])
+    app.config.setdefault('METRICS_PROFILE_DIR', None)
+    if not app.config['METRICS_ENABLED']:
+        return
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor):
+        event.listen(Engine, 'before_cursor_execute', before_cursor)
+        event.listen(Engine, 'after_cursor_execute', after_cursor)
+    before_render_template.connect(before_template, app)
+    template_rendered.connect(after_template, app)
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.teardown_request(teardown)
+    if app.config['METRICS_TOKEN']:
+        app.add_url_rule('/metrics', 'metrics', metrics_view)
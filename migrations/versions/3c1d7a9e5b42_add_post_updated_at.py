@@ -0,0 +1,28 @@
+"""Add updated_at to blog posts
+
+Revision ID: 3c1d7a9e5b42
+Revises: e475bc2890fa
+Create Date: 2026-10-17 10:12:41.508213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1d7a9e5b42'
+down_revision = 'e475bc2890fa'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing posts get the migration time as their first modification time
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP'),
+                                      nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
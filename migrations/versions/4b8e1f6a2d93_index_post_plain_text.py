@@ -0,0 +1,91 @@
+"""Add blog_posts.body_text and search it instead of the HTML body
+
+Revision ID: 4b8e1f6a2d93
+Revises: 9d4e7a2c1f58
+Create Date: 2026-10-18 09:12:47.205316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b8e1f6a2d93'
+down_revision = '9d4e7a2c1f58'
+branch_labels = None
+depends_on = None
+
+
+# Same DDL as search.py, copied here so the migration doesn't change if the app code does
+def sqlite_index(body):
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS blog_posts_fts USING fts5(
+            title, subtitle, {body}, content='blog_posts', content_rowid='id', tokenize='porter unicode61')""",
+        f"""CREATE TRIGGER IF NOT EXISTS blog_posts_fts_insert AFTER INSERT ON blog_posts BEGIN
+            INSERT INTO blog_posts_fts(rowid, title, subtitle, {body})
+            VALUES (new.id, new.title, new.subtitle, new.{body});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS blog_posts_fts_delete AFTER DELETE ON blog_posts BEGIN
+            INSERT INTO blog_posts_fts(blog_posts_fts, rowid, title, subtitle, {body})
+            VALUES ('delete', old.id, old.title, old.subtitle, old.{body});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS blog_posts_fts_update AFTER UPDATE OF title, subtitle, {body} ON blog_posts BEGIN
+            INSERT INTO blog_posts_fts(blog_posts_fts, rowid, title, subtitle, {body})
+            VALUES ('delete', old.id, old.title, old.subtitle, old.{body});
+            INSERT INTO blog_posts_fts(rowid, title, subtitle, {body})
+            VALUES (new.id, new.title, new.subtitle, new.{body});
+        END""",
+        "INSERT INTO blog_posts_fts(blog_posts_fts) VALUES ('rebuild')",
+    ]
+
+
+SQLITE_DROP_INDEX = [
+    "DROP TRIGGER IF EXISTS blog_posts_fts_update",
+    "DROP TRIGGER IF EXISTS blog_posts_fts_delete",
+    "DROP TRIGGER IF EXISTS blog_posts_fts_insert",
+    "DROP TABLE IF EXISTS blog_posts_fts",
+]
+
+
+def postgres_index(body):
+    return [
+        f"""ALTER TABLE blog_posts ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(subtitle, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce({body}, '')), 'C')) STORED""",
+        "CREATE INDEX IF NOT EXISTS ix_blog_posts_search_vector ON blog_posts USING GIN (search_vector)",
+    ]
+
+
+POSTGRES_DROP_INDEX = [
+    "DROP INDEX IF EXISTS ix_blog_posts_search_vector",
+    "ALTER TABLE blog_posts DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def drop_index(dialect):
+    for statement in {'sqlite': SQLITE_DROP_INDEX, 'postgresql': POSTGRES_DROP_INDEX}.get(dialect, []):
+        op.execute(statement)
+
+
+def create_index(dialect, body):
+    for statement in {'sqlite': sqlite_index, 'postgresql': postgres_index}.get(dialect, lambda body: [])(body):
+        op.execute(statement)
+
+
+# body_text needs the Python cleaner, run "flask posts reprocess" after upgrading to fill it in and
+# rebuild the index. Until then only titles and subtitles are searched.
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    drop_index(dialect)
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('body_text', sa.Text(), nullable=True))
+    create_index(dialect, 'body_text')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    drop_index(dialect)
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.drop_column('body_text')
+    create_index(dialect, 'body')
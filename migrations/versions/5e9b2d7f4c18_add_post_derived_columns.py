@@ -0,0 +1,39 @@
+"""Add precomputed body_html, excerpt and stats to blog posts
+
+Revision ID: 5e9b2d7f4c18
+Revises: d41c9e7b2a06
+Create Date: 2026-10-17 17:55:40.972614
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e9b2d7f4c18'
+down_revision = 'd41c9e7b2a06'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('body_html', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('excerpt', sa.String(length=500), nullable=True))
+        batch_op.add_column(sa.Column('word_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('reading_time', sa.Integer(), server_default='1', nullable=False))
+        batch_op.add_column(sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Comment counts are cheap to fill in SQL. body_html, excerpt and word counts need the
+    # Python cleaner, run "flask posts reprocess" after upgrading to fill them in batches.
+    op.execute("UPDATE blog_posts SET comment_count = "
+               "(SELECT COUNT(*) FROM comments WHERE comments.post_id = blog_posts.id)")
+
+
+def downgrade():
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.drop_column('comment_count')
+        batch_op.drop_column('reading_time')
+        batch_op.drop_column('word_count')
+        batch_op.drop_column('excerpt')
+        batch_op.drop_column('body_html')
@@ -0,0 +1,33 @@
+"""Store the img_url of uploaded images as a /media/ path without the host
+
+Revision ID: 7c2a9e5d3b16
+Revises: 4b8e1f6a2d93
+Create Date: 2026-10-18 11:40:05.318224
+
+"""
+from alembic import op
+from urllib.parse import urlparse
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2a9e5d3b16'
+down_revision = '4b8e1f6a2d93'
+branch_labels = None
+depends_on = None
+
+
+# Only posts with an uploaded image; links to other sites are left alone
+def upgrade():
+    connection = op.get_bind()
+    posts = connection.execute(sa.text(
+        "SELECT id, img_url FROM blog_posts WHERE image_id IS NOT NULL AND img_url LIKE '%://%/media/%'"
+    )).all()
+    for post_id, img_url in posts:
+        connection.execute(sa.text("UPDATE blog_posts SET img_url = :path WHERE id = :id"),
+                           {"path": urlparse(img_url).path, "id": post_id})
+
+
+# The host the URLs were made with is gone, relative paths work on every version of the app
+def downgrade():
+    pass
@@ -0,0 +1,50 @@
+"""Add users.subscribed and mailings
+
+Revision ID: 9d4e7a2c1f58
+Revises: f2b6d9e4a1c7
+Create Date: 2026-10-17 23:02:16.448391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4e7a2c1f58'
+down_revision = 'f2b6d9e4a1c7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('subscribed', sa.Boolean(), server_default=sa.false(), nullable=False))
+        batch_op.create_index('ix_users_subscribed_id', ['subscribed', 'id'], unique=False)
+
+    op.create_table('mailings',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('base_url', sa.String(length=250), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('last_user_id', sa.Integer(), nullable=False),
+        sa.Column('sent', sa.Integer(), nullable=False),
+        sa.Column('failed', sa.Integer(), nullable=False),
+        sa.Column('deferred', sa.Integer(), nullable=False),
+        sa.Column('locked_until', sa.DateTime(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['post_id'], ['blog_posts.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('mailings', schema=None) as batch_op:
+        batch_op.create_index('ix_mailings_status_locked_until', ['status', 'locked_until'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('mailings', schema=None) as batch_op:
+        batch_op.drop_index('ix_mailings_status_locked_until')
+
+    op.drop_table('mailings')
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index('ix_users_subscribed_id')
+        batch_op.drop_column('subscribed')
@@ -0,0 +1,125 @@
+"""Convert blog_posts.date to a timestamp and index foreign keys
+
+Revision ID: a6d0c3f8e217
+Revises: 5e9b2d7f4c18
+Create Date: 2026-10-17 19:21:08.255930
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d0c3f8e217'
+down_revision = '5e9b2d7f4c18'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+DISPLAY_FORMAT = "%B %d, %Y"  # what add_new_post used to store, e.g. "October 17, 2026"
+OTHER_FORMATS = ["%b %d, %Y", "%Y-%m-%d", "%d %B %Y", "%m/%d/%Y"]
+
+# Recreating blog_posts in SQLite batch mode drops its triggers, so the search triggers are put back
+SQLITE_SEARCH_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS blog_posts_fts_insert AFTER INSERT ON blog_posts BEGIN
+        INSERT INTO blog_posts_fts(rowid, title, subtitle, body) VALUES (new.id, new.title, new.subtitle, new.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS blog_posts_fts_delete AFTER DELETE ON blog_posts BEGIN
+        INSERT INTO blog_posts_fts(blog_posts_fts, rowid, title, subtitle, body)
+        VALUES ('delete', old.id, old.title, old.subtitle, old.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS blog_posts_fts_update AFTER UPDATE OF title, subtitle, body ON blog_posts BEGIN
+        INSERT INTO blog_posts_fts(blog_posts_fts, rowid, title, subtitle, body)
+        VALUES ('delete', old.id, old.title, old.subtitle, old.body);
+        INSERT INTO blog_posts_fts(rowid, title, subtitle, body) VALUES (new.id, new.title, new.subtitle, new.body);
+    END""",
+]
+
+posts = sa.table(
+    'blog_posts',
+    sa.column('id', sa.Integer),
+    sa.column('date', sa.String),
+    sa.column('date_value', sa.DateTime),
+    sa.column('updated_at', sa.DateTime),
+)
+
+
+# Dates the app didn't write itself fall back to the post's last modification time
+def parse_date(text, fallback):
+    for fmt in [DISPLAY_FORMAT] + OTHER_FORMATS:
+        try:
+            return datetime.strptime((text or '').strip(), fmt)
+        except ValueError:
+            continue
+    return fallback
+
+
+# Copies one column into another in batches of BATCH_SIZE rows, walking the primary key
+def copy_in_batches(source, target, convert):
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(posts.c.id, source, posts.c.updated_at)
+            .where(posts.c.id > last_id)
+            .order_by(posts.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        connection.execute(
+            posts.update().where(posts.c.id == sa.bindparam('post_id')).values({target.name: sa.bindparam('value')}),
+            [{'post_id': row[0], 'value': convert(row[1], row[2])} for row in rows],
+        )
+        last_id = rows[-1][0]
+
+
+def restore_search_triggers():
+    if op.get_bind().dialect.name == 'sqlite':
+        for statement in SQLITE_SEARCH_TRIGGERS:
+            op.execute(statement)
+
+
+def upgrade():
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('date_value', sa.DateTime(), nullable=True))
+
+    copy_in_batches(posts.c.date, posts.c.date_value, parse_date)
+
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.drop_column('date')
+
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.alter_column('date_value', new_column_name='date', existing_type=sa.DateTime(), nullable=False)
+
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.create_index('ix_blog_posts_date', ['date'], unique=False)
+        batch_op.create_index('ix_blog_posts_author_id', ['author_id'], unique=False)
+
+    # comments.post_id is already covered by ix_comments_post_id_id
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.create_index('ix_comments_author_id', ['author_id'], unique=False)
+
+    restore_search_triggers()
+
+
+def downgrade():
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.drop_index('ix_comments_author_id')
+
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.drop_index('ix_blog_posts_author_id')
+        batch_op.drop_index('ix_blog_posts_date')
+        batch_op.alter_column('date', new_column_name='date_value', existing_type=sa.DateTime(), nullable=True)
+
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('date', sa.String(length=250), nullable=True))
+
+    copy_in_batches(posts.c.date_value, posts.c.date, lambda value, _: value.strftime(DISPLAY_FORMAT))
+
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.drop_column('date_value')
+        batch_op.alter_column('date', existing_type=sa.String(length=250), nullable=False)
+
+    restore_search_triggers()
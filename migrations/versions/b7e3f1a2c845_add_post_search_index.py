@@ -0,0 +1,68 @@
+"""Add full-text search index on blog posts
+
+Revision ID: b7e3f1a2c845
+Revises: 8f2a4c6e1d93
+Create Date: 2026-10-17 15:02:33.640118
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3f1a2c845'
+down_revision = '8f2a4c6e1d93'
+branch_labels = None
+depends_on = None
+
+
+# Same DDL as search.py, copied here so the migration doesn't change if the app code does
+SQLITE_UPGRADE = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS blog_posts_fts USING fts5(
+        title, subtitle, body, content='blog_posts', content_rowid='id', tokenize='porter unicode61')""",
+    """CREATE TRIGGER IF NOT EXISTS blog_posts_fts_insert AFTER INSERT ON blog_posts BEGIN
+        INSERT INTO blog_posts_fts(rowid, title, subtitle, body) VALUES (new.id, new.title, new.subtitle, new.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS blog_posts_fts_delete AFTER DELETE ON blog_posts BEGIN
+        INSERT INTO blog_posts_fts(blog_posts_fts, rowid, title, subtitle, body)
+        VALUES ('delete', old.id, old.title, old.subtitle, old.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS blog_posts_fts_update AFTER UPDATE OF title, subtitle, body ON blog_posts BEGIN
+        INSERT INTO blog_posts_fts(blog_posts_fts, rowid, title, subtitle, body)
+        VALUES ('delete', old.id, old.title, old.subtitle, old.body);
+        INSERT INTO blog_posts_fts(rowid, title, subtitle, body) VALUES (new.id, new.title, new.subtitle, new.body);
+    END""",
+    # Index the posts that already exist
+    "INSERT INTO blog_posts_fts(blog_posts_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS blog_posts_fts_update",
+    "DROP TRIGGER IF EXISTS blog_posts_fts_delete",
+    "DROP TRIGGER IF EXISTS blog_posts_fts_insert",
+    "DROP TABLE IF EXISTS blog_posts_fts",
+]
+
+POSTGRES_UPGRADE = [
+    """ALTER TABLE blog_posts ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(subtitle, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(body, '')), 'C')) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_blog_posts_search_vector ON blog_posts USING GIN (search_vector)",
+]
+
+POSTGRES_DOWNGRADE = [
+    "DROP INDEX IF EXISTS ix_blog_posts_search_vector",
+    "ALTER TABLE blog_posts DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    for statement in {'sqlite': SQLITE_UPGRADE, 'postgresql': POSTGRES_UPGRADE}.get(dialect, []):
+        op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    for statement in {'sqlite': SQLITE_DOWNGRADE, 'postgresql': POSTGRES_DOWNGRADE}.get(dialect, []):
+        op.execute(statement)
@@ -0,0 +1,68 @@
+"""Add images and blog_posts.image_id
+
+Revision ID: c5f8a1d3e690
+Revises: a6d0c3f8e217
+Create Date: 2026-10-17 21:04:37.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5f8a1d3e690'
+down_revision = 'a6d0c3f8e217'
+branch_labels = None
+depends_on = None
+
+# Recreating blog_posts in SQLite batch mode drops its triggers, so the search triggers are put back
+SQLITE_SEARCH_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS blog_posts_fts_insert AFTER INSERT ON blog_posts BEGIN
+        INSERT INTO blog_posts_fts(rowid, title, subtitle, body) VALUES (new.id, new.title, new.subtitle, new.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS blog_posts_fts_delete AFTER DELETE ON blog_posts BEGIN
+        INSERT INTO blog_posts_fts(blog_posts_fts, rowid, title, subtitle, body)
+        VALUES ('delete', old.id, old.title, old.subtitle, old.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS blog_posts_fts_update AFTER UPDATE OF title, subtitle, body ON blog_posts BEGIN
+        INSERT INTO blog_posts_fts(blog_posts_fts, rowid, title, subtitle, body)
+        VALUES ('delete', old.id, old.title, old.subtitle, old.body);
+        INSERT INTO blog_posts_fts(rowid, title, subtitle, body) VALUES (new.id, new.title, new.subtitle, new.body);
+    END""",
+]
+
+
+def restore_search_triggers():
+    if op.get_bind().dialect.name == 'sqlite':
+        for statement in SQLITE_SEARCH_TRIGGERS:
+            op.execute(statement)
+
+
+def upgrade():
+    op.create_table('images',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('hash', sa.String(length=64), nullable=False),
+        sa.Column('ext', sa.String(length=10), nullable=False),
+        sa.Column('width', sa.Integer(), nullable=True),
+        sa.Column('height', sa.Integer(), nullable=True),
+        sa.Column('widths', sa.String(length=100), nullable=True),
+        sa.Column('placeholder', sa.Text(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('hash')
+    )
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('image_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_blog_posts_image_id_images', 'images', ['image_id'], ['id'])
+        batch_op.create_index('ix_blog_posts_image_id', ['image_id'], unique=False)
+    restore_search_triggers()
+
+
+def downgrade():
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.drop_index('ix_blog_posts_image_id')
+        batch_op.drop_constraint('fk_blog_posts_image_id_images', type_='foreignkey')
+        batch_op.drop_column('image_id')
+    restore_search_triggers()
+    op.drop_table('images')
@@ -0,0 +1,25 @@
+"""Add (post_id, id) index on comments
+
+Revision ID: d41c9e7b2a06
+Revises: b7e3f1a2c845
+Create Date: 2026-10-17 16:27:19.384502
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41c9e7b2a06'
+down_revision = 'b7e3f1a2c845'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.create_index('ix_comments_post_id_id', ['post_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.drop_index('ix_comments_post_id_id')
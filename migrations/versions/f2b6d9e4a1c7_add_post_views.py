@@ -0,0 +1,34 @@
+"""Add post_views
+
+Revision ID: f2b6d9e4a1c7
+Revises: c5f8a1d3e690
+Create Date: 2026-10-17 22:11:52.730148
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b6d9e4a1c7'
+down_revision = 'c5f8a1d3e690'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('post_views',
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('post_id', 'day')
+    )
+    with op.batch_alter_table('post_views', schema=None) as batch_op:
+        batch_op.create_index('ix_post_views_day', ['day', 'post_id', 'count'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('post_views', schema=None) as batch_op:
+        batch_op.drop_index('ix_post_views_day')
+
+    op.drop_table('post_views')
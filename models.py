@@ -1,10 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from itsdangerous import URLSafeTimedSerializer
+from itsdangerous import URLSafeSerializer, URLSafeTimedSerializer, BadSignature
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import Integer, String, Text
+from sqlalchemy import Boolean, Integer, String, Text, Date, DateTime, func
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from flask import current_app
+from datetime import date, datetime, timezone
+from dbrouting import RoutingSession
 
 
 # create database
@@ -12,7 +14,13 @@ class Base(DeclarativeBase):
     pass
 
 
-db = SQLAlchemy(model_class=Base)
+# RoutingSession sends read-only GET requests to the read replica when DB_REPLICA_URI is set
+db = SQLAlchemy(model_class=Base, session_options={"class_": RoutingSession})
+
+
+# Timestamps are stored as naive UTC so SQLite and Postgres compare them the same way
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
 # TABLES
@@ -20,19 +28,63 @@ class BlogPost(db.Model):
     __tablename__ = "blog_posts"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     # Create Foreign Key, "users.id" the users refers to the tablename of User.
-    author_id: Mapped[int] = mapped_column(Integer, db.ForeignKey("users.id"))
+    author_id: Mapped[int] = mapped_column(Integer, db.ForeignKey("users.id"), index=True)
     # Create reference to the User object. The "posts" refers to the posts property in the User class.
     author = relationship("User", back_populates="posts")
     title: Mapped[str] = mapped_column(String(250), unique=True, nullable=False)
     subtitle: Mapped[str] = mapped_column(String(250), nullable=False)
-    date: Mapped[str] = mapped_column(String(250), nullable=False)
+    # Publication time, indexed for the year/month archives
+    date: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow, index=True)
     body: Mapped[str] = mapped_column(Text, nullable=False)
     img_url: Mapped[str] = mapped_column(String(250), nullable=False)
+    # Derived from body when the post is saved (see content.py), so pages never compute them per view
+    body_html: Mapped[str] = mapped_column(Text, nullable=True)
+    excerpt: Mapped[str] = mapped_column(String(500), nullable=True)
+    # Plain text of the cleaned body, what the search index covers
+    body_text: Mapped[str] = mapped_column(Text, nullable=True)
+    word_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    reading_time: Mapped[int] = mapped_column(Integer, nullable=False, default=1, server_default="1")
+    comment_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    # Last time the post or its comments changed, used for ETag / Last-Modified
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow, onupdate=utcnow,
+                                                 server_default=func.now())
+    # Uploaded header image with its resized variants, img_url still points at the original
+    image_id: Mapped[int] = mapped_column(Integer, db.ForeignKey("images.id"), nullable=True, index=True)
+    image = relationship("Image")
 
     # Parent relationship to the comments
     comments = relationship("Comment", back_populates="parent_post")
 
 
+# Views per post and day, added in batches by the view counter (see viewcounts.py). There is no foreign
+# key: a batch can still carry views of a post deleted since it was counted, and nothing joins to those.
+class PostView(db.Model):
+    __tablename__ = "post_views"
+    post_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    # Covers the popular posts query, which adds up the last few days
+    __table_args__ = (db.Index("ix_post_views_day", "day", "post_id", "count"),)
+
+
+# Uploaded post images, stored on disk under their content hash with resized variants (see images.py)
+class Image(db.Model):
+    __tablename__ = "images"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    hash: Mapped[str] = mapped_column(String(64), unique=True, nullable=False)  # sha256 of the original
+    ext: Mapped[str] = mapped_column(String(10), nullable=False)  # extension of the original, e.g. ".jpg"
+    width: Mapped[int] = mapped_column(Integer, nullable=True)
+    height: Mapped[int] = mapped_column(Integer, nullable=True)
+    # Comma separated widths of the WebP and JPEG variants that were written
+    widths: Mapped[str] = mapped_column(String(100), nullable=True)
+    # A tiny blurred JPEG as a data: URI, shown while the real image loads
+    placeholder: Mapped[str] = mapped_column(Text, nullable=True)
+    # pending -> ready once the variants exist, or failed
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="pending")
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow)
+
+
 # User table for all registered users
 class User(UserMixin, db.Model):
     __tablename__ = "users"
@@ -40,6 +92,8 @@ class User(UserMixin, db.Model):
     email: Mapped[str] = mapped_column(String(100), unique=True)
     password: Mapped[str] = mapped_column(String(300))
     name: Mapped[str] = mapped_column(String(100))
+    # Gets an email for every new post (see mailings.py)
+    subscribed: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False, server_default=db.false())
     # This will act like a list of BlogPost objects attached to each User.
     # The "author" refers to the author property in the BlogPost class.
     posts = relationship("BlogPost", back_populates="author")
@@ -59,6 +113,27 @@ class User(UserMixin, db.Model):
             return None
         return User.query.get(user_id)
 
+    # For the unsubscribe link in the new-post emails. It does not expire, old emails keep working.
+    def get_unsubscribe_token(self):
+        return User.unsubscribe_token(self.id)
+
+    @staticmethod
+    def unsubscribe_token(user_id):
+        s = URLSafeSerializer(current_app.config['SECRET_KEY'], salt='unsubscribe-salt')
+        return s.dumps(user_id)
+
+    @staticmethod
+    def verify_unsubscribe_token(token):
+        s = URLSafeSerializer(current_app.config['SECRET_KEY'], salt='unsubscribe-salt')
+        try:
+            user_id = s.loads(token)
+        except BadSignature:
+            return None
+        return db.session.get(User, user_id)
+
+    # The new-post emails walk the subscribers in id order
+    __table_args__ = (db.Index("ix_users_subscribed_id", "subscribed", "id"),)
+
 
 # Table for the comments on the blog posts
 class Comment(db.Model):
@@ -67,8 +142,55 @@ class Comment(db.Model):
     text: Mapped[str] = mapped_column(Text, nullable=False)
     # Child relationship:"users.id" The users refers to the tablename of the User class.
     # "comments" refers to the comments property in the User class.
-    author_id: Mapped[int] = mapped_column(Integer, db.ForeignKey("users.id"))
+    author_id: Mapped[int] = mapped_column(Integer, db.ForeignKey("users.id"), index=True)
     comment_author = relationship("User", back_populates="comments")
     # Child Relationship to the BlogPosts
     post_id: Mapped[str] = mapped_column(Integer, db.ForeignKey("blog_posts.id"))
     parent_post = relationship("BlogPost", back_populates="comments")
+
+    # Comments are listed per post, newest first
+    __table_args__ = (db.Index("ix_comments_post_id_id", "post_id", "id"),)
+
+
+# Outgoing emails are written here by the routes and sent later by the outbox worker (see outbox.py)
+class OutboxMessage(db.Model):
+    __tablename__ = "outbox"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    from_addr: Mapped[str] = mapped_column(String(250), nullable=False)
+    to_addr: Mapped[str] = mapped_column(String(250), nullable=False)
+    message: Mapped[str] = mapped_column(Text, nullable=False)
+    # pending -> sending (claimed by a worker) -> sent, or dead after too many failed attempts
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="pending")
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # When a pending message may be tried again, or when a worker's claim on it runs out
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow)
+    last_error: Mapped[str] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow)
+    sent_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (db.Index("ix_outbox_status_next_attempt_at", "status", "next_attempt_at"),)
+
+
+# One new-post email to every subscriber, sent by "flask mailings run" (see mailings.py). Subscribers
+# are mailed in id order and last_user_id is saved after every chunk, so a stopped run carries on
+# where it left off.
+class Mailing(db.Model):
+    __tablename__ = "mailings"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    post_id: Mapped[int] = mapped_column(Integer, db.ForeignKey("blog_posts.id"), nullable=False)
+    post = relationship("BlogPost")
+    # Site URL when the post was published, for the links in the email
+    base_url: Mapped[str] = mapped_column(String(250), nullable=False)
+    # pending -> sending (claimed by a worker) -> done
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="pending")
+    last_user_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    sent: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # Refused for good (5xx), or handed to the outbox to be retried
+    failed: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    deferred: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # When a worker's claim on the mailing runs out
+    locked_until: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow)
+    finished_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (db.Index("ix_mailings_status_locked_until", "status", "locked_until"),)
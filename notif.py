@@ -1,28 +1,54 @@
-import smtplib
-import os
+from email.message import EmailMessage
+from email import policy
+from flask import current_app
+from outbox import queue_email
+import logging
 
+logger = logging.getLogger(__name__)
 
+
+# Header values come from the contact form; a line break in them would make EmailMessage refuse
+# the header (and would start a new header if it didn't)
+def one_line(value):
+    return " ".join((value or "").splitlines()).strip()
+
+
+# A plain text email in UTF-8. Headers and body are encoded for SMTP, so the text stored in the
+# outbox is ASCII whatever the reader typed.
+def build_message(subject, from_addr, to_addr, body):
+    message = EmailMessage(policy=policy.SMTP)
+    message['Subject'] = one_line(subject)
+    message['From'] = one_line(from_addr)
+    message['To'] = one_line(to_addr)
+    message.set_content(body, cte='quoted-printable')
+    return message
+
+
+# Builds the emails sent by the website. Nothing is sent inside the request: the message is
+# queued in the outbox table and delivered by the worker ("flask outbox run").
 class Notification:
     def __init__(self, name_subj, email_frm, phone_to, message):
         self.sender_name_subj = name_subj
-        self.sender_email_frm = email_frm
+        # Also the envelope sender, which goes into an SMTP command
+        self.sender_email_frm = one_line(email_frm)
         self.sender_phone_to = phone_to
         self.sender_message = message
 
     def send_email(self):
-        with smtplib.SMTP("smtp.gmail.com", port=587) as connection:
-            connection.starttls()
-            connection.login(user=os.getenv("MY_MAIL_ADDRESS"), password=os.getenv("MAIL_APP_PW"))
-            connection.sendmail(from_addr=self.sender_email_frm,
-                                to_addrs=self.sender_phone_to,
-                                msg=f"Subject:{self.sender_name_subj} \n\n{self.sender_email_frm} "
-                                    f"\n\n{self.sender_message}")
+        queue_email(from_addr=self.sender_email_frm,
+                    to_addr=self.sender_phone_to,
+                    message=build_message(self.sender_name_subj, self.sender_email_frm, self.sender_phone_to,
+                                          f"{self.sender_email_frm} \n\n{self.sender_message}"))
 
+    # Sent to the blog's own address (MAIL_USERNAME), returns False when none is configured
     def contact_email(self):
-        with smtplib.SMTP("smtp.gmail.com", port=587) as connection:
-            connection.starttls()
-            connection.login(user=os.getenv("MY_MAIL_ADDRESS"), password=os.getenv("MAIL_APP_PW"))
-            connection.sendmail(from_addr=self.sender_email_frm,
-                                to_addrs=os.environ.get('MY_MAIL_ADDRESS'),
-                                msg=f"Subject:{self.sender_name_subj} \n\n{self.sender_email_frm} "
-                                    f"\n\n{self.sender_phone_to}\n\n{self.sender_message}")
+        to_addr = current_app.config['MAIL_USERNAME']
+        if not to_addr:
+            logger.error("Contact message from %s dropped, MAIL_USERNAME is not set", self.sender_email_frm)
+            return False
+        queue_email(from_addr=self.sender_email_frm,
+                    to_addr=to_addr,
+                    message=build_message(self.sender_name_subj, self.sender_email_frm, to_addr,
+                                          f"{self.sender_email_frm} \n\n{self.sender_phone_to}\n\n"
+                                          f"{self.sender_message}"))
+        return True
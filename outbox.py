@@ -0,0 +1,172 @@
+from datetime import timedelta
+from email import message_from_string, policy
+from email.message import EmailMessage
+from flask import current_app
+from flask.cli import AppGroup
+from models import OutboxMessage, db, utcnow
+from metrics import timed
+import click
+import logging
+import smtplib
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Called by the routes: store the email and return straight away, the worker sends it later
+@timed('mail')
+def queue_email(from_addr, to_addr, message):
+    if isinstance(message, EmailMessage):
+        message = message.as_string()
+    db.session.add(OutboxMessage(from_addr=from_addr, to_addr=to_addr, message=message))
+    db.session.commit()
+
+
+# One authenticated SMTP connection kept open and reused for every message the worker sends
+class SMTPSender:
+    def __init__(self, host, port, use_tls=True, username=None, password=None, timeout=30):
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.connection = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['MAIL_SERVER'], config['MAIL_PORT'], use_tls=config['MAIL_USE_TLS'],
+                   username=config['MAIL_USERNAME'], password=config['MAIL_PASSWORD'])
+
+    def connect(self):
+        connection = smtplib.SMTP(self.host, port=self.port, timeout=self.timeout)
+        if self.use_tls:
+            connection.starttls()
+        if self.username:
+            connection.login(user=self.username, password=self.password)
+        self.connection = connection
+
+    # message is an EmailMessage, or a string already encoded for SMTP (ASCII only)
+    def send(self, from_addr, to_addr, message):
+        if self.connection is None:
+            self.connect()
+        try:
+            self._send(from_addr, to_addr, message)
+        except smtplib.SMTPServerDisconnected:
+            # The server closed our idle connection, log in again once and retry
+            self.connection = None
+            self.connect()
+            self._send(from_addr, to_addr, message)
+
+    def _send(self, from_addr, to_addr, message):
+        if isinstance(message, EmailMessage):
+            self.connection.send_message(message, from_addr=from_addr, to_addrs=to_addr)
+        else:
+            self.connection.sendmail(from_addr=from_addr, to_addrs=to_addr, msg=message)
+
+    def close(self):
+        if self.connection is None:
+            return
+        try:
+            self.connection.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self.connection = None
+
+
+# 5xx replies (bad recipient, rejected message) will fail the same way every time
+def is_permanent(error):
+    return ((isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500)
+            or isinstance(error, smtplib.SMTPRecipientsRefused))
+
+
+# Claims due messages with a lease so several workers never send the same one. A worker that dies
+# mid-batch leaves its claims to expire, and the messages are picked up again (at-least-once delivery).
+def claim_batch(batch_size, lease):
+    now = utcnow()
+    messages = db.session.execute(
+        db.select(OutboxMessage)
+        .where(OutboxMessage.status.in_(["pending", "sending"]), OutboxMessage.next_attempt_at <= now)
+        .order_by(OutboxMessage.next_attempt_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    for message in messages:
+        message.status = "sending"
+        message.next_attempt_at = now + timedelta(seconds=lease)
+    db.session.commit()
+    return messages
+
+
+# Every failure is recorded on the message, so one bad message can't stop the worker and
+# end up claimed over and over
+def deliver(sender, message):
+    config = current_app.config
+    try:
+        sender.send(message.from_addr, message.to_addr, message_from_string(message.message, policy=policy.SMTP))
+    except Exception as error:
+        message.attempts += 1
+        message.last_error = repr(error)
+        # Anything but an SMTP or network error (a message that can't be encoded) fails the same way every time
+        broken = not isinstance(error, (smtplib.SMTPException, OSError))
+        if broken or is_permanent(error) or message.attempts >= config['OUTBOX_MAX_ATTEMPTS']:
+            message.status = "dead"
+            logger.error("Outbox message %s is dead after %s attempts: %r", message.id, message.attempts, error)
+        else:
+            # Exponential backoff: 30s, 60s, 120s... with the default OUTBOX_RETRY_DELAY
+            delay = config['OUTBOX_RETRY_DELAY'] * 2 ** (message.attempts - 1)
+            message.status = "pending"
+            message.next_attempt_at = utcnow() + timedelta(seconds=delay)
+        # Don't keep using a connection that just failed
+        if not is_permanent(error):
+            sender.close()
+    else:
+        message.status = "sent"
+        message.sent_at = utcnow()
+        message.last_error = None
+    db.session.commit()
+
+
+# Sends one batch of due messages and returns how many were processed
+def drain(sender, batch_size=50):
+    config = current_app.config
+    messages = claim_batch(batch_size, config['OUTBOX_LEASE'])
+    for message in messages:
+        deliver(sender, message)
+    return len(messages)
+
+
+outbox_cli = AppGroup('outbox', help="Send the emails queued by the website.")
+
+
+@outbox_cli.command('run')
+@click.option('--poll-interval', default=5.0, help="Seconds to wait when the outbox is empty.")
+@click.option('--batch-size', default=50)
+def run_worker(poll_interval, batch_size):
+    """Keep sending queued emails until stopped."""
+    sender = SMTPSender.from_config(current_app.config)
+    try:
+        while True:
+            if not drain(sender, batch_size):
+                # Nothing to send, hang up instead of holding an idle connection open
+                sender.close()
+                time.sleep(poll_interval)
+    finally:
+        sender.close()
+
+
+@outbox_cli.command('drain')
+@click.option('--batch-size', default=50)
+def drain_once(batch_size):
+    """Send everything that is due right now, then exit."""
+    sender = SMTPSender.from_config(current_app.config)
+    total = 0
+    try:
+        while True:
+            processed = drain(sender, batch_size)
+            if not processed:
+                break
+            total += processed
+    finally:
+        sender.close()
+    click.echo(f"Processed {total} messages.")
@@ -0,0 +1,147 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from flask.cli import AppGroup
+from functools import lru_cache
+from werkzeug.security import generate_password_hash, check_password_hash
+import click
+import os
+import threading
+import time
+
+# All password hashing goes through here. The hashes are computed in a small pool of low-priority
+# processes, and only a bounded number of requests may wait on it, so a burst of logins gets
+# fast 503s instead of eating the CPU the page-serving workers need.
+
+
+class HashingBusy(Exception):
+    pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = None
+
+
+def _lower_priority(niceness):
+    os.nice(niceness)
+
+
+def get_pool():
+    global _pool, _slots
+    config = current_app.config
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=config['PASSWORD_HASH_WORKERS'],
+                                        initializer=_lower_priority,
+                                        initargs=(config['PASSWORD_HASH_NICE'],))
+            _slots = threading.BoundedSemaphore(config['PASSWORD_HASH_MAX_PENDING'])
+    return _pool
+
+
+# A hashing process that died (OOM kill, segfault) breaks the whole pool, the next get_pool() starts a new one
+def discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def submit_hashing(func, *args):
+    config = current_app.config
+    pool = get_pool()
+    # Admission control: give up quickly when too many hashes are already queued in this worker
+    slots = _slots
+    if not slots.acquire(timeout=config['PASSWORD_HASH_WAIT']):
+        raise HashingBusy()
+    try:
+        future = pool.submit(func, *args)
+    except BaseException as e:
+        slots.release()
+        if isinstance(e, BrokenProcessPool):
+            discard_pool(pool)
+        raise
+    # The slot is held until the hash is done, not just while this request waits for it,
+    # so hashes left running after a timeout still count towards PASSWORD_HASH_MAX_PENDING
+    future.add_done_callback(lambda future: slots.release())
+    try:
+        return future.result(timeout=config['PASSWORD_HASH_TIMEOUT'])
+    except TimeoutError:
+        raise HashingBusy()
+    except BrokenProcessPool:
+        discard_pool(pool)
+        raise
+
+
+def run_hashing(func, *args):
+    if not current_app.config['PASSWORD_HASH_WORKERS']:
+        return func(*args)
+    try:
+        return submit_hashing(func, *args)
+    except BrokenProcessPool:
+        pass
+    # Once more on a fresh pool
+    try:
+        return submit_hashing(func, *args)
+    except BrokenProcessPool:
+        raise HashingBusy()
+
+
+def hash_password(password):
+    config = current_app.config
+    return run_hashing(generate_password_hash, password, config['PASSWORD_HASH_METHOD'],
+                       config['PASSWORD_SALT_LENGTH'])
+
+
+def check_password(stored_hash, password):
+    return run_hashing(check_password_hash, stored_hash, password)
+
+
+# "pbkdf2:sha256" is stored as "pbkdf2:sha256:600000", so compare against what werkzeug really writes.
+# Costs one hash the first time a method is seen.
+@lru_cache(maxsize=None)
+def full_method(method):
+    return generate_password_hash("", method, 1).split("$", 1)[0]
+
+
+def policy_method():
+    return full_method(current_app.config['PASSWORD_HASH_METHOD'])
+
+
+# True when a stored hash was made with a different algorithm, cost or a shorter salt than the policy
+def needs_rehash(stored_hash):
+    method, _, rest = stored_hash.partition("$")
+    salt = rest.partition("$")[0]
+    return method != policy_method() or len(salt) < current_app.config['PASSWORD_SALT_LENGTH']
+
+
+passwords_cli = AppGroup('passwords', help="Password hashing tools.")
+
+BENCHMARK_METHODS = [
+    "pbkdf2:sha256:100000",
+    "pbkdf2:sha256:300000",
+    "pbkdf2:sha256:600000",
+    "pbkdf2:sha256:1000000",
+    "scrypt:16384:8:1",
+    "scrypt:32768:8:1",
+    "scrypt:65536:8:1",
+]
+
+
+@passwords_cli.command('benchmark')
+@click.option('--method', 'methods', multiple=True, help="Method to time, can be repeated. Defaults to a range of costs.")
+@click.option('--seconds', default=2.0, help="How long to hash for at each setting.")
+def benchmark(methods, seconds):
+    """Report hashes per second for each hashing cost on this machine."""
+    salt_length = current_app.config['PASSWORD_SALT_LENGTH']
+    current = policy_method()
+    for method in methods or BENCHMARK_METHODS:
+        count = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            generate_password_hash("correct horse battery staple", method, salt_length)
+            count += 1
+        elapsed = time.perf_counter() - started
+        marker = "  <- current policy" if full_method(method) == current else ""
+        click.echo(f"{method:<24} {count / elapsed:8.1f} hashes/sec  {elapsed / count * 1000:7.1f} ms/hash{marker}")
@@ -0,0 +1,185 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from flask import current_app
+from flask.cli import AppGroup
+from conditional import listing_version
+from models import BlogPost, db
+from viewcounts import view_counter
+import click
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+# Renders the pages anonymous readers see (index, archive, about and every post) into a directory
+# that nginx or a CDN can serve without the app. A manifest keeps the version each page was built
+# from, so a rebuild only renders posts that were edited or commented on, plus the index and archive.
+#
+# Requests the files cannot answer go to the app: anything with a query string (archive pages,
+# "load more" comments without JavaScript) and anyone logged in, e.g. for nginx
+#
+#   location / {
+#       if ($cookie_session) { proxy_pass http://app; }
+#       if ($args) { proxy_pass http://app; }
+#       try_files $uri $uri/index.html @app;
+#   }
+#
+# The pages are the anonymous ones, so they carry no comment form or admin buttons; the comment
+# list loads more on demand from the JSON endpoint.
+
+prerender_cli = AppGroup('prerender', help="Render the public pages to static files.")
+
+# Settings for the rendering app: no cached copies, no limits, timing headers or counted views
+RENDER_CONFIG = {"PAGE_CACHE_BACKEND": "null", "RATE_LIMIT_ENABLED": False, "METRICS_ENABLED": False,
+                 "QUERY_BUDGET_MODE": "off", "VIEW_COUNTS_ENABLED": False}
+
+_client = None
+
+
+def output_file(path):
+    return "index.html" if path == "/" else f"{path.strip('/')}/index.html"
+
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+# Each pool process builds its own app and renders through the test client, exactly as the
+# app would answer an anonymous reader
+def start_worker(config):
+    global _client
+    from main import create_app
+    _client = create_app(config).test_client()
+
+
+def render_pages(output, paths):
+    rendered, failed = [], []
+    for path in paths:
+        response = _client.get(path)
+        if response.status_code == 200:
+            write_atomic(os.path.join(output, output_file(path)), response.get_data())
+            rendered.append(path)
+        else:
+            failed.append((path, response.status_code))
+    return rendered, failed
+
+
+# Changes to the templates or the page code change every page, so they force a full rebuild
+def build_fingerprint():
+    digest = hashlib.sha1()
+    root = current_app.root_path
+    for dirpath, _, filenames in sorted(os.walk(os.path.join(root, current_app.template_folder))):
+        for filename in sorted(filenames):
+            with open(os.path.join(dirpath, filename), 'rb') as f:
+                digest.update(filename.encode() + f.read())
+    for module in ('routes.py', 'content.py', 'forms.py'):
+        with open(os.path.join(root, module), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def page_versions(batch_size):
+    last_modified, listing = listing_version()
+    # The index also shows the most read posts, so it is rebuilt when that list may have changed
+    versions = {"/": f"{listing}:{view_counter.popular_version()}", "/blog-archive": listing, "/about": "about"}
+    rows = db.session.execute(
+        db.select(BlogPost.id, BlogPost.updated_at).order_by(BlogPost.id).execution_options(yield_per=batch_size)
+    )
+    for post_id, updated_at in rows:
+        versions[f"/post/{post_id}"] = str(updated_at)
+    return versions
+
+
+# Copies the static folder next to the pages, skipping files that did not change
+def copy_static(output):
+    source = current_app.static_folder
+    copied = 0
+    for dirpath, _, filenames in os.walk(source):
+        target_dir = os.path.join(output, 'static', os.path.relpath(dirpath, source))
+        os.makedirs(target_dir, exist_ok=True)
+        for filename in filenames:
+            src = os.path.join(dirpath, filename)
+            dst = os.path.join(target_dir, filename)
+            stat = os.stat(src)
+            try:
+                current = os.stat(dst)
+                if current.st_size == stat.st_size and current.st_mtime == stat.st_mtime:
+                    continue
+            except OSError:
+                pass
+            shutil.copy2(src, dst)
+            copied += 1
+    return copied
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+@prerender_cli.command('build')
+@click.argument('output')
+@click.option('--workers', default=os.cpu_count() or 1, help="Rendering processes.")
+@click.option('--chunk-size', default=50, help="Pages handed to a process at a time.")
+@click.option('--full', is_flag=True, help="Render every page, not only the changed ones.")
+def build(output, workers, chunk_size, full):
+    """Render the public pages into OUTPUT, only re-rendering what changed since the last build."""
+    started = time.perf_counter()
+    os.makedirs(output, exist_ok=True)
+    manifest_path = os.path.join(output, 'manifest.json')
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {"build": None, "pages": {}}
+
+    fingerprint = build_fingerprint()
+    if manifest["build"] != fingerprint:
+        full = True
+    versions = page_versions(chunk_size * 20)
+    built = {} if full else manifest["pages"]
+    todo = [path for path, version in versions.items()
+            if built.get(path) != version or not os.path.exists(os.path.join(output, output_file(path)))]
+
+    # Posts that were deleted since the last build
+    removed = [path for path in manifest["pages"] if path not in versions]
+    for path in removed:
+        try:
+            os.remove(os.path.join(output, output_file(path)))
+            os.rmdir(os.path.dirname(os.path.join(output, output_file(path))))
+        except OSError:
+            pass
+
+    config = dict(RENDER_CONFIG, SQLALCHEMY_DATABASE_URI=current_app.config['SQLALCHEMY_DATABASE_URI'])
+    rendered, failed = [], []
+    if workers > 1 and len(todo) > chunk_size:
+        with ProcessPoolExecutor(max_workers=workers, initializer=start_worker, initargs=(config,)) as pool:
+            for done, errors in pool.map(partial(render_pages, output), chunks(todo, chunk_size)):
+                rendered += done
+                failed += errors
+                click.echo(f"\rRendered {len(rendered)}/{len(todo)} pages", nl=False)
+        click.echo()
+    elif todo:
+        start_worker(config)
+        rendered, failed = render_pages(output, todo)
+
+    pages = {path: version for path, version in built.items() if path in versions}
+    pages.update({path: versions[path] for path in rendered})
+    write_atomic(manifest_path, json.dumps({"build": fingerprint, "pages": pages}, indent=1).encode())
+    copied = copy_static(output)
+
+    for path, status in failed:
+        click.echo(f"Skipped {path}: status {status}", err=True)
+    click.echo(f"Rendered {len(rendered)} of {len(versions)} pages, removed {len(removed)}, "
+               f"copied {copied} static files in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,61 @@
+from functools import wraps
+from flask import g, request, current_app, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+# Decorator to set how many SQL statements a route may run per request
+def query_budget(limit):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            return f(*args, **kwargs)
+
+        decorated_function.query_budget = limit
+        return decorated_function
+
+    return decorator
+
+
+# Runs for every statement on every engine, only counts while a request is being checked
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'query_count' in g:
+        g.query_count += 1
+
+
+def start_counting():
+    g.query_count = 0
+
+
+def check_budget(response):
+    if 'query_count' not in g:
+        return response
+    count = g.pop('query_count')
+    response.headers['X-Query-Count'] = str(count)
+
+    view = current_app.view_functions.get(request.endpoint)
+    limit = getattr(view, 'query_budget', None)
+    if limit is not None and count > limit:
+        message = f"{request.endpoint} ran {count} SQL statements, budget is {limit}"
+        if current_app.config['QUERY_BUDGET_MODE'] == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+    return response
+
+
+# QUERY_BUDGET_MODE: "off" (default), "log" to warn or "raise" to fail requests that go over budget
+def init_app(app):
+    app.config.setdefault('QUERY_BUDGET_MODE', 'off')
+    if app.config['QUERY_BUDGET_MODE'] == 'off':
+        return
+    if not event.contains(Engine, 'before_cursor_execute', count_query):
+        event.listen(Engine, 'before_cursor_execute', count_query)
+    app.before_request(start_counting)
+    app.after_request(check_budget)
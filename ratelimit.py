@@ -0,0 +1,188 @@
+from functools import wraps
+from flask import request, session, current_app
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+# Token buckets for the write and mail endpoints. Every client IP, and every logged-in user, gets a
+# bucket per limit that refills at a steady rate; a request takes one token and is answered with a
+# 429 when the bucket is empty. The check runs before the view, so a rejected request never parses
+# its form or touches the database.
+
+# name -> {"ip": spec, "user": spec}, a spec is "<requests>/<second|minute|hour|day>".
+# RATE_LIMITS in the config overrides single entries.
+DEFAULT_LIMITS = {
+    "comment": {"ip": "20/minute", "user": "5/minute"},
+    "login": {"ip": "10/minute"},
+    "register": {"ip": "5/hour"},
+    "contact": {"ip": "5/hour"},
+    "recovery": {"ip": "5/hour"},
+    "reset_password": {"ip": "10/hour"},
+}
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def parse_limit(spec):
+    count, _, period = spec.partition("/")
+    return int(count), int(count) / PERIODS[period.strip()]
+
+
+# Returns (tokens left, seconds until the next token) after trying to take one from a bucket
+# that had `tokens` tokens at time `updated`
+def take(tokens, updated, now, capacity, rate):
+    if tokens is None:
+        tokens = capacity
+    else:
+        tokens = min(capacity, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+# Buckets for this process only, every gunicorn worker counts on its own
+class MemoryBackend:
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (None, now))
+            tokens, retry_after = take(tokens, updated, now, capacity, rate)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_entries:
+                # Drop the buckets that have been idle longest, they are the closest to full anyway
+                for old in sorted(self._buckets, key=lambda k: self._buckets[k][1])[:self.max_entries // 10]:
+                    del self._buckets[old]
+        return retry_after
+
+
+# Buckets in a small SQLite file next to the app, shared by every worker on the machine.
+# Each check is one short write transaction; the file is disposable and never synced to disk.
+class SQLiteBackend:
+    def __init__(self, path, prune_every=1000):
+        self.path = path
+        self.prune_every = prune_every
+        self._local = threading.local()
+        self._checks = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        return conn
+
+    def connection(self):
+        if getattr(self._local, "conn", None) is None:
+            self._local.conn = self._connect()
+        return self._local.conn
+
+    def consume(self, key, capacity, rate):
+        conn = self.connection()
+        now = time.time()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            # Locked for longer than the timeout: let the request through rather than fail it
+            logger.warning("Rate limit store busy, not limiting %s", key)
+            return 0
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, retry_after = take(row[0] if row else None, row[1] if row else now, now, capacity, rate)
+            conn.execute("INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                         "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                         (key, tokens, now))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._checks += 1
+        if self._checks % self.prune_every == 0:
+            # A bucket idle for a day is full again whatever its limit, so it can go
+            conn.execute("DELETE FROM buckets WHERE updated < ?", (now - PERIODS["day"],))
+        return retry_after
+
+
+class RateLimiter:
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATE_LIMIT_ENABLED', True)
+        app.config.setdefault('RATE_LIMIT_BACKEND', 'memory')
+        app.config.setdefault('RATE_LIMIT_PATH', None)
+        app.config.setdefault('RATE_LIMIT_TRUSTED_PROXIES', 0)
+        app.config.setdefault('RATE_LIMITS', {})
+        kind = app.config['RATE_LIMIT_BACKEND']
+        if not app.config['RATE_LIMIT_ENABLED'] or kind == 'null':
+            self.backend = None
+        elif kind == 'sqlite':
+            self.backend = SQLiteBackend(app.config['RATE_LIMIT_PATH']
+                                         or os.path.join(app.instance_path, 'ratelimit.sqlite'))
+        elif kind == 'memory':
+            self.backend = MemoryBackend()
+        else:
+            raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {kind}")
+        app.extensions['rate_limiter'] = self
+
+    def limits(self, name):
+        return dict(DEFAULT_LIMITS.get(name, {}), **current_app.config['RATE_LIMITS'].get(name, {}))
+
+    # Behind a proxy (e.g. the Heroku router) the client is the address the last trusted proxy saw
+    def client_ip(self):
+        proxies = current_app.config['RATE_LIMIT_TRUSTED_PROXIES']
+        forwarded = [ip.strip() for ip in request.headers.get('X-Forwarded-For', '').split(',') if ip.strip()]
+        if proxies and len(forwarded) >= proxies:
+            return forwarded[-proxies]
+        return request.remote_addr or 'unknown'
+
+    # Seconds to wait if any of the buckets for this request is empty, otherwise 0.
+    # The user id comes from the session cookie so the user is not loaded for the check.
+    def check(self, name):
+        wait = 0
+        for scope, spec in self.limits(name).items():
+            if scope == 'ip':
+                subject = self.client_ip()
+            elif scope == 'user':
+                subject = session.get('_user_id')
+                if subject is None:
+                    continue
+            else:
+                raise ValueError(f"Unknown rate limit scope: {scope}")
+            capacity, rate = parse_limit(spec)
+            wait = max(wait, self.backend.consume(f"{name}:{scope}:{subject}", capacity, rate))
+        return wait
+
+    # Decorator for a view, only the listed methods are counted
+    def limit(self, name, methods=('POST',)):
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if self.backend is None or request.method not in methods:
+                    return f(*args, **kwargs)
+                wait = self.check(name)
+                if wait:
+                    return ("Too many requests, please slow down and try again shortly.", 429,
+                            {"Retry-After": str(math.ceil(wait))})
+                return f(*args, **kwargs)
+
+            return decorated_function
+
+        return decorator
+
+
+rate_limiter = RateLimiter()
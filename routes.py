@@ -1,12 +1,25 @@
-from flask import Blueprint, abort, render_template, redirect, url_for, flash, request
-from datetime import date
-from sqlalchemy import desc
+from flask import Blueprint, abort, render_template, redirect, url_for, flash, request, current_app, jsonify
+from datetime import date, datetime
+from sqlalchemy import desc, func, tuple_
+from sqlalchemy.orm import load_only, joinedload, defer
 from functools import wraps
-from werkzeug.security import generate_password_hash, check_password_hash
-from forms import CreatePostForm, RegisterForm, LoginForm, CommentForm, RecoveryForm, ResetPasswordForm
+from forms import CreatePostForm, RegisterForm, LoginForm, CommentForm, RecoveryForm, ResetPasswordForm, SubscriptionForm
 from notif import Notification
 from flask_login import login_user, current_user, logout_user
-from models import BlogPost, User, Comment, db
+from models import BlogPost, User, Comment, Mailing, db, utcnow
+from querycount import query_budget
+from cache import page_cache
+from conditional import conditional, current_version, listing_version, post_version
+from search import search_posts
+from usercache import user_cache
+from content import process_post
+from dbrouting import replica_reads
+from ratelimit import rate_limiter
+from viewcounts import view_counter
+from passwords import hash_password, check_password, needs_rehash, HashingBusy
+import feeds
+import images
+import mailings
 
 views = Blueprint('views', __name__)
 
@@ -24,8 +37,39 @@ def admin_only(f):
     return decorated_function
 
 
+# Listing pages only show the title, subtitle, author, date and precomputed stats, so leave the post body in the database.
+# The author is joined in the same query so the templates don't run one SELECT per post.
+def post_listing():
+    return db.select(BlogPost).options(
+        load_only(BlogPost.id, BlogPost.title, BlogPost.subtitle, BlogPost.date, BlogPost.author_id,
+                  BlogPost.reading_time, BlogPost.comment_count),
+        joinedload(BlogPost.author).load_only(User.name),
+    )
+
+
+# One page of a post's comments, newest first, with their authors joined in.
+# after is the id of the last comment already shown; (post_id, id) is indexed so this is a range scan.
+def comment_page(post_id, after=None):
+    page_size = current_app.config['COMMENTS_PAGE_SIZE']
+    query = db.select(Comment).options(
+        joinedload(Comment.comment_author).load_only(User.id, User.name, User.email)
+    ).where(Comment.post_id == post_id)
+    if after is not None:
+        query = query.where(Comment.id < after)
+    comments = db.session.execute(query.order_by(desc(Comment.id)).limit(page_size + 1)).scalars().all()
+    next_cursor = comments[page_size - 1].id if len(comments) > page_size else None
+    return comments[:page_size], next_cursor
+
+
+# Hashing pool is full: answer fast and let the client retry instead of queueing more CPU work
+@views.app_errorhandler(HashingBusy)
+def hashing_busy(error):
+    return "Too many sign-ins right now, please try again in a few seconds.", 503, {"Retry-After": "5"}
+
+
 # Register new users into the User database
 @views.route('/register', methods=["GET", "POST"])
+@rate_limiter.limit("register")
 def register():
     form = RegisterForm()
     if form.validate_on_submit():
@@ -38,15 +82,12 @@ def register():
             flash("You've already signed up with that email, log in instead!", "danger")
             return redirect(url_for('views.login'))
 
-        hash_and_salted_password = generate_password_hash(
-            form.password.data,
-            method='pbkdf2:sha256',
-            salt_length=8
-        )
+        hash_and_salted_password = hash_password(form.password.data)
         new_user = User(
             email=form.email.data,
             name=form.name.data,
             password=hash_and_salted_password,
+            subscribed=form.subscribe.data,
         )
         db.session.add(new_user)
         db.session.commit()
@@ -57,6 +98,7 @@ def register():
 
 
 @views.route('/login', methods=["GET", "POST"])
+@rate_limiter.limit("login")
 def login():
     form = LoginForm()
     if form.validate_on_submit():
@@ -69,10 +111,14 @@ def login():
             flash("That email does not exist, please try again.", "danger")
             return redirect(url_for('views.login'))
         # Password incorrect
-        elif not check_password_hash(user.password, password):
+        elif not check_password(user.password, password):
             flash('Password incorrect, please try again.', "danger")
             return redirect(url_for('views.login'))
         else:
+            # Upgrade hashes made under an older or weaker policy while we have the plain password
+            if needs_rehash(user.password):
+                user.password = hash_password(password)
+                db.session.commit()
             login_user(user)
             return redirect(url_for('views.get_all_posts'))
 
@@ -81,28 +127,139 @@ def login():
 
 @views.route('/logout')
 def logout():
+    if current_user.is_authenticated:
+        user_cache.invalidate(current_user.id)
     logout_user()
     return redirect(url_for('views.get_all_posts'))
 
 
+# The index also lists the most read posts, which change without any post changing
+def index_version():
+    last_modified, version = listing_version()
+    return last_modified, f"{version}:{view_counter.popular_version()}"
+
+
 @views.route('/')
+@query_budget(4)
+@replica_reads
+@conditional(index_version)
+@page_cache.cached("index", version=current_version)
 def get_all_posts():
-    result = db.session.execute(db.select(BlogPost).order_by(desc(BlogPost.id)).limit(3))
+    result = db.session.execute(post_listing().order_by(desc(BlogPost.id)).limit(3))
     posts = result.scalars().all()
-    return render_template("index.html", all_posts=posts, current_user=current_user)
+    return render_template("index.html", all_posts=posts, popular_posts=view_counter.popular_posts(),
+                           current_user=current_user)
 
 
+# Keyset pagination on the post id: ?before=<id> walks to older posts, ?after=<id> walks back to newer ones
 @views.route('/blog-archive')
+@query_budget(3)
+@replica_reads
+@conditional(listing_version)
+@page_cache.cached("archive", version=current_version)
 def blog_archive():
-    result = db.session.execute(db.select(BlogPost).order_by(desc(BlogPost.id)))
-    posts = result.scalars().all()
-    return render_template("all_posts.html", all_posts=posts, current_user=current_user)
+    page_size = current_app.config['ARCHIVE_PAGE_SIZE']
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+
+    query = post_listing()
+    if after is not None:
+        # Read upwards from the cursor and flip the page afterwards so it is still newest first
+        query = query.where(BlogPost.id > after).order_by(BlogPost.id)
+    else:
+        if before is not None:
+            query = query.where(BlogPost.id < before)
+        query = query.order_by(desc(BlogPost.id))
+
+    # Fetch one extra row to know if there is another page without running a COUNT
+    posts = db.session.execute(query.limit(page_size + 1)).scalars().all()
+    has_more = len(posts) > page_size
+    posts = posts[:page_size]
+
+    if after is not None:
+        posts.reverse()
+        newer = posts[0].id if has_more else None
+        older = posts[-1].id if posts else None
+    else:
+        newer = posts[0].id if before is not None and posts else None
+        older = posts[-1].id if has_more else None
+
+    return render_template("all_posts.html", all_posts=posts, newer=newer, older=older, now_year=date.today().year,
+                           current_user=current_user)
+
+
+# Year archive: how many posts were published in each month, counted over the date index
+@views.route('/archive/<int:year>')
+@query_budget(2)
+@replica_reads
+@page_cache.cached("archive")
+def archive_year(year):
+    if not 1 <= year < 9999:
+        abort(404)
+    month = func.extract('month', BlogPost.date).label('month')
+    result = db.session.execute(
+        db.select(month, func.count(BlogPost.id))
+        .where(BlogPost.date >= datetime(year, 1, 1), BlogPost.date < datetime(year + 1, 1, 1))
+        .group_by(month)
+        .order_by(desc(month))
+    )
+    months = [(date(year, int(number), 1), count) for number, count in result]
+    return render_template("archive.html", year=year, months=months, current_user=current_user)
+
+
+# Month archive: a range scan on the date index, paged with ?before=<id of the last post shown>
+@views.route('/archive/<int:year>/<int:month>')
+@query_budget(3)
+@replica_reads
+@page_cache.cached("archive")
+def archive_month(year, month):
+    if not 1 <= year < 9999 or not 1 <= month <= 12:
+        abort(404)
+    start = datetime(year, month, 1)
+    end = datetime(year + month // 12, month % 12 + 1, 1)
+    query = post_listing().where(BlogPost.date >= start, BlogPost.date < end)
+
+    before = request.args.get('before', type=int)
+    if before is not None:
+        cursor_date = db.session.execute(db.select(BlogPost.date).where(BlogPost.id == before)).scalar()
+        if cursor_date is not None:
+            query = query.where(tuple_(BlogPost.date, BlogPost.id) < tuple_(cursor_date, before))
+
+    page_size = current_app.config['ARCHIVE_PAGE_SIZE']
+    posts = db.session.execute(
+        query.order_by(desc(BlogPost.date), desc(BlogPost.id)).limit(page_size + 1)
+    ).scalars().all()
+    older = posts[page_size - 1].id if len(posts) > page_size else None
+    return render_template("archive.html", year=year, month=start, all_posts=posts[:page_size], older=older,
+                           current_user=current_user)
+
+
+# Ranked full-text search, paginated with ?page= because results are ordered by relevance
+@views.route('/search')
+@query_budget(2)
+@replica_reads
+def search():
+    q = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    results, has_more = [], False
+    if q:
+        results, has_more = search_posts(q, page, current_app.config['SEARCH_PAGE_SIZE'])
+    return render_template("search.html", q=q, results=results, page=page, has_more=has_more,
+                           current_user=current_user)
 
 
 # View post
 @views.route("/post/<int:post_id>", methods=["GET", "POST"])
+@rate_limiter.limit("comment")
+@query_budget(5)
+@replica_reads
+@view_counter.counted
+@conditional(post_version)
+@page_cache.cached("post:{post_id}", version=current_version)
 def show_post(post_id):
-    requested_post = db.get_or_404(BlogPost, post_id)
+    # The page shows the cleaned body_html, the raw body is only needed by the edit form and the text by search
+    requested_post = db.get_or_404(BlogPost, post_id, options=[joinedload(BlogPost.author), joinedload(BlogPost.image),
+                                                               defer(BlogPost.body), defer(BlogPost.body_text)])
     # Add the CommentForm to the route
     comment_form = CommentForm()
     # Only allow logged-in users to comment on posts
@@ -113,31 +270,101 @@ def show_post(post_id):
 
         new_comment = Comment(
             text=comment_form.comment_text.data,
-            comment_author=current_user,
+            author_id=current_user.id,
             parent_post=requested_post
         )
+        requested_post.updated_at = utcnow()
+        requested_post.comment_count = BlogPost.comment_count + 1
         db.session.add(new_comment)
         db.session.commit()
-    return render_template("post.html", post=requested_post,
+        # The listings show the comment count too
+        page_cache.invalidate("index", "archive", f"post:{post_id}")
+        # Redirect so the page is rendered by a fresh GET with everything eager loaded again
+        return redirect(url_for("views.show_post", post_id=post_id))
+    comments, next_cursor = comment_page(post_id, request.args.get('after', type=int))
+    return render_template("post.html", post=requested_post, comments=comments, next_cursor=next_cursor,
                            current_user=current_user, form=comment_form)
 
 
+# JSON for the "Load more comments" button on the post page
+@views.route("/post/<int:post_id>/comments")
+@query_budget(2)
+@replica_reads
+def post_comments(post_id):
+    comments, next_cursor = comment_page(post_id, request.args.get('after', type=int))
+    avatar = current_app.jinja_env.filters['avatar']
+    return jsonify(
+        comments=[{
+            "id": comment.id,
+            "text": comment.text,
+            "author": comment.comment_author.name,
+            "avatar": avatar(comment.comment_author.email),
+            "delete_url": url_for('views.delete_comment', comment_id=comment.id, post_id=post_id)
+            if current_user.is_authenticated and current_user.id in (comment.author_id, 4) else None,
+        } for comment in comments],
+        next=next_cursor,
+    )
+
+
+# Built once per change to the posts, see feeds.py
+@views.route('/feed.atom')
+@query_budget(1)
+@replica_reads
+def atom_feed():
+    return feeds.serve('feed.atom', feeds.build_atom, 'application/atom+xml')
+
+
+@views.route('/feed.rss')
+@query_budget(1)
+@replica_reads
+def rss_feed():
+    return feeds.serve('feed.rss', feeds.build_rss, 'application/rss+xml')
+
+
+@views.route('/sitemap.xml')
+@query_budget(1)
+@replica_reads
+def sitemap():
+    return feeds.serve('sitemap.xml', feeds.build_sitemap, 'application/xml')
+
+
+# The Image for the form's upload, None without one, or False (with the error on the form) when
+# the file is not a usable image
+def uploaded_image(form):
+    if not form.image.data:
+        return None
+    try:
+        return images.save_upload(form.image.data)
+    except ValueError as e:
+        form.image.errors.append(str(e))
+        return False
+
+
 @views.route("/new-post", methods=["GET", "POST"])
 @admin_only
 def add_new_post():
     form = CreatePostForm()
     if form.validate_on_submit():
-        new_post = BlogPost(
-            title=form.title.data,
-            subtitle=form.subtitle.data,
-            body=form.body.data,
-            img_url=form.img_url.data,
-            author=current_user,
-            date=date.today().strftime("%B %d, %Y")
-        )
-        db.session.add(new_post)
-        db.session.commit()
-        return redirect(url_for("views.get_all_posts"))
+        image = uploaded_image(form)
+        if image is not False:
+            new_post = BlogPost(
+                title=form.title.data,
+                subtitle=form.subtitle.data,
+                body=form.body.data,
+                img_url=images.original_url(image) if image else form.img_url.data,
+                image=image,
+                author_id=current_user.id,
+                date=utcnow()
+            )
+            process_post(new_post)
+            db.session.add(new_post)
+            mailings.queue_mailing(new_post)  # emailed to the subscribers by "flask mailings run"
+            db.session.commit()
+            if image:
+                images.schedule(image)
+            page_cache.invalidate("index", "archive")
+            feeds.invalidate()
+            return redirect(url_for("views.get_all_posts"))
     return render_template("make-post.html", form=form, current_user=current_user)
 
 
@@ -148,18 +375,31 @@ def edit_post(post_id):
     edit_form = CreatePostForm(
         title=post.title,
         subtitle=post.subtitle,
-        img_url=post.img_url,
+        img_url=images.absolute_url(post.img_url),
         author=post.author,
         body=post.body
     )
     if edit_form.validate_on_submit():
-        post.title = edit_form.title.data
-        post.subtitle = edit_form.subtitle.data
-        post.img_url = edit_form.img_url.data
-        post.author = current_user
-        post.body = edit_form.body.data
-        db.session.commit()
-        return redirect(url_for("views.show_post", post_id=post.id))
+        image = uploaded_image(edit_form)
+        if image is not False:
+            post.title = edit_form.title.data
+            post.subtitle = edit_form.subtitle.data
+            if image:
+                post.image = image
+                post.img_url = images.original_url(image)
+            elif edit_form.img_url.data != images.absolute_url(post.img_url):
+                # A new link replaces the uploaded image
+                post.image = None
+                post.img_url = edit_form.img_url.data
+            post.author_id = current_user.id
+            post.body = edit_form.body.data
+            process_post(post)
+            db.session.commit()
+            if image:
+                images.schedule(image)
+            page_cache.invalidate("index", "archive", f"post:{post.id}")
+            feeds.invalidate()
+            return redirect(url_for("views.show_post", post_id=post.id))
     return render_template("make-post.html", form=edit_form, is_edit=True, current_user=current_user)
 
 
@@ -167,20 +407,29 @@ def edit_post(post_id):
 @admin_only
 def delete_post(post_id):
     post_to_delete = db.get_or_404(BlogPost, post_id)
+    db.session.execute(db.delete(Mailing).where(Mailing.post_id == post_id))
     db.session.delete(post_to_delete)
+    view_counter.forget(post_id)
     db.session.commit()
+    page_cache.invalidate("index", "archive", f"post:{post_id}")
+    feeds.invalidate()
     return redirect(url_for('views.get_all_posts'))
 
 
 @views.route("/delete-comment/<int:comment_id>/<int:post_id>")
 def delete_comment(comment_id, post_id):
     comment_to_delete = db.get_or_404(Comment, comment_id)
+    parent_post_id = comment_to_delete.post_id
+    comment_to_delete.parent_post.updated_at = utcnow()
+    comment_to_delete.parent_post.comment_count = BlogPost.comment_count - 1
     db.session.delete(comment_to_delete)
     db.session.commit()
+    page_cache.invalidate("index", "archive", f"post:{parent_post_id}")
     return redirect(url_for('views.show_post', post_id=post_id))  # post id is the id of the blogpost
 
 
 @views.route("/recovery", methods=["GET", "POST"])
+@rate_limiter.limit("recovery")
 def account_recovery():
     recovery_form = RecoveryForm()
     if recovery_form.validate_on_submit():
@@ -209,6 +458,7 @@ def account_recovery():
 
 
 @views.route('/reset-password/<token>', methods=['GET', 'POST'])
+@rate_limiter.limit("reset_password")
 def reset_password(token):
     reset_password_form = ResetPasswordForm()
     user = User.verify_reset_token(token)
@@ -227,22 +477,57 @@ def reset_password(token):
             return redirect(request.url)
 
         # 🔐 Hash the password before saving
-        hashed_pw = generate_password_hash(password)
+        hashed_pw = hash_password(password)
 
         user.password = hashed_pw
         db.session.commit()
+        user_cache.invalidate(user.id)
         flash('Your password has been updated!', 'success')
         return redirect(url_for('views.login'))
 
     return render_template('reset.html', form=reset_password_form)
 
 
+# Logged-in readers switch the new-post emails on and off here
+@views.route("/subscription", methods=["GET", "POST"])
+def subscription():
+    if not current_user.is_authenticated:
+        flash("Log in or register to get an email for new posts.", "danger")
+        return redirect(url_for("views.login"))
+    user = db.session.get(User, current_user.id)
+    form = SubscriptionForm()
+    if form.validate_on_submit():
+        user.subscribed = not user.subscribed
+        db.session.commit()
+        flash("You will get an email for every new post." if user.subscribed
+              else "You will no longer get emails for new posts.", "success")
+        return redirect(url_for("views.subscription"))
+    form.submit.label.text = "Unsubscribe" if user.subscribed else "Subscribe"
+    return render_template("subscription.html", form=form, subscribed=user.subscribed, current_user=current_user)
+
+
+# The link in every new-post email. The token is the authentication, so this works logged out and
+# answers the one-click POST mail providers send for List-Unsubscribe-Post (which has no CSRF token).
+@views.route("/unsubscribe/<token>", methods=["GET", "POST"])
+def unsubscribe(token):
+    user = User.verify_unsubscribe_token(token)
+    if user is None:
+        abort(404)
+    if request.method == "POST":
+        user.subscribed = False
+        db.session.commit()
+    return render_template("unsubscribe.html", subscribed=user.subscribed, current_user=current_user)
+
+
 @views.route("/about")
+@query_budget(1)
+@page_cache.cached("about")
 def about():
     return render_template("about.html", current_user=current_user)
 
 
 @views.route("/contact", methods=["GET", "POST"])
+@rate_limiter.limit("contact")
 def contact():
     if request.method == "POST":
         data = request.form  # gets data from html forms
@@ -253,7 +538,9 @@ def contact():
         message = data["message"]
 
         send_notification = Notification(name, email, phone, message)  # creates object from Notification class
-        send_notification.contact_email()
-        flash('Your Message Has Been Sent Successfully!', 'success')
+        if send_notification.contact_email():
+            flash('Your Message Has Been Sent Successfully!', 'success')
+        else:
+            flash("Sorry, messages can't be sent right now. Please try again later.", 'danger')
         return redirect(url_for('views.contact'))
     return render_template("contact.html")
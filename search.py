@@ -0,0 +1,134 @@
+from markupsafe import Markup, escape
+from sqlalchemy import event, func, text, DateTime
+from models import BlogPost, User, db
+import re
+
+# Full-text search over the title, subtitle and plain text body (body_text, see content.py) of the posts,
+# so markup and the scripts the cleaner drops are never matched.
+# SQLite uses an FTS5 table kept in sync by triggers, Postgres a generated tsvector column with a GIN index.
+# Other databases get a plain LIKE search without ranking or highlights.
+
+SQLITE_INDEX = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS blog_posts_fts USING fts5(
+        title, subtitle, body_text, content='blog_posts', content_rowid='id', tokenize='porter unicode61')""",
+    """CREATE TRIGGER IF NOT EXISTS blog_posts_fts_insert AFTER INSERT ON blog_posts BEGIN
+        INSERT INTO blog_posts_fts(rowid, title, subtitle, body_text)
+        VALUES (new.id, new.title, new.subtitle, new.body_text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS blog_posts_fts_delete AFTER DELETE ON blog_posts BEGIN
+        INSERT INTO blog_posts_fts(blog_posts_fts, rowid, title, subtitle, body_text)
+        VALUES ('delete', old.id, old.title, old.subtitle, old.body_text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS blog_posts_fts_update AFTER UPDATE OF title, subtitle, body_text ON blog_posts BEGIN
+        INSERT INTO blog_posts_fts(blog_posts_fts, rowid, title, subtitle, body_text)
+        VALUES ('delete', old.id, old.title, old.subtitle, old.body_text);
+        INSERT INTO blog_posts_fts(rowid, title, subtitle, body_text)
+        VALUES (new.id, new.title, new.subtitle, new.body_text);
+    END""",
+]
+
+POSTGRES_INDEX = [
+    """ALTER TABLE blog_posts ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(subtitle, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(body_text, '')), 'C')) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_blog_posts_search_vector ON blog_posts USING GIN (search_vector)",
+]
+
+# The database wraps matches in these, they are turned into <mark> after the snippet is escaped
+START_MARK = "\x02"
+STOP_MARK = "\x03"
+
+
+# Fresh databases made by db.create_all() get the index too, migrations add it to existing ones
+@event.listens_for(BlogPost.__table__, "after_create")
+def create_search_index(target, connection, **kw):
+    statements = {"sqlite": SQLITE_INDEX, "postgresql": POSTGRES_INDEX}.get(connection.dialect.name, [])
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+# The FTS5 tables and the tsvector column are managed here, not by the models, so keep
+# "flask db migrate" from trying to drop them
+def include_object(obj, name, type_, reflected, compare_to):
+    if type_ == "table" and name.startswith("blog_posts_fts"):
+        return False
+    if type_ in ("column", "index") and name in ("search_vector", "ix_blog_posts_search_vector"):
+        return False
+    return True
+
+
+# Turns what the reader typed into an FTS5 query: every word must match, as a prefix
+def fts5_query(q):
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", q))
+
+
+SQLITE_SEARCH = text("""
+    SELECT p.id, p.title, p.subtitle, p.date, u.name AS author_name,
+           snippet(blog_posts_fts, 2, :start, :stop, '…', 24) AS snippet
+    FROM blog_posts_fts
+    JOIN blog_posts p ON p.id = blog_posts_fts.rowid
+    JOIN users u ON u.id = p.author_id
+    WHERE blog_posts_fts MATCH :query
+    ORDER BY bm25(blog_posts_fts, 10.0, 5.0, 1.0), p.id DESC
+    LIMIT :limit OFFSET :offset
+""").columns(date=DateTime)
+
+POSTGRES_SEARCH = text("""
+    SELECT p.id, p.title, p.subtitle, p.date, u.name AS author_name,
+           ts_headline('english', coalesce(p.body_text, ''), query, :options) AS snippet
+    FROM blog_posts p
+    JOIN users u ON u.id = p.author_id,
+         websearch_to_tsquery('english', :query) query
+    WHERE p.search_vector @@ query
+    ORDER BY ts_rank_cd(p.search_vector, query) DESC, p.id DESC
+    LIMIT :limit OFFSET :offset
+""").columns(date=DateTime)
+
+
+# Every word in the title, subtitle or body, newest first, with the excerpt as the snippet
+def like_search(words):
+    columns = (BlogPost.title, BlogPost.subtitle, BlogPost.body_text)
+    return (
+        db.select(BlogPost.id, BlogPost.title, BlogPost.subtitle, BlogPost.date,
+                  User.name.label("author_name"), BlogPost.excerpt.label("snippet"))
+        .join(User, User.id == BlogPost.author_id)
+        .where(*[db.or_(*[func.lower(column).contains(word.lower(), autoescape=True) for column in columns])
+                 for word in words])
+        .order_by(BlogPost.date.desc(), BlogPost.id.desc())
+    )
+
+
+# Returns one page of ranked results and whether there is another page after it
+def search_posts(q, page=1, page_size=10):
+    dialect = db.engine.dialect.name
+    params = {"limit": page_size + 1, "offset": (page - 1) * page_size}
+    if dialect == "sqlite":
+        query = fts5_query(q)
+        if not query:
+            return [], False
+        rows = db.session.execute(SQLITE_SEARCH, dict(params, query=query, start=START_MARK, stop=STOP_MARK))
+    elif dialect == "postgresql":
+        options = f"StartSel={START_MARK}, StopSel={STOP_MARK}, MaxWords=35, MinWords=15, MaxFragments=1"
+        rows = db.session.execute(POSTGRES_SEARCH, dict(params, query=q, options=options))
+    else:
+        words = re.findall(r"\w+", q)
+        if not words:
+            return [], False
+        rows = db.session.execute(like_search(words).limit(params["limit"]).offset(params["offset"]))
+    results = [dict(row._mapping, snippet=highlight(row.snippet)) for row in rows]
+    return results[:page_size], len(results) > page_size
+
+
+# The snippet is plain text: escape it and turn the database's match markers into <mark> elements
+def highlight(snippet):
+    snippet = str(escape(snippet or ""))
+    return Markup(snippet.replace(START_MARK, "<mark>").replace(STOP_MARK, "</mark>"))
+
+
+# Reindexes every post from body_text, after "flask posts reprocess" filled it in. Postgres keeps
+# its generated column up to date by itself.
+def rebuild_search_index():
+    if db.engine.dialect.name == "sqlite":
+        db.session.execute(text("INSERT INTO blog_posts_fts(blog_posts_fts) VALUES ('rebuild')"))
+        db.session.commit()
@@ -27,3 +27,49 @@ window.addEventListener('DOMContentLoaded', () => {
         scrollPos = currentTop;
     });
 })
+
+// Load older comments from the JSON endpoint instead of reloading the whole post
+window.addEventListener('DOMContentLoaded', () => {
+    const loadMore = document.getElementById('load-more-comments');
+    if (!loadMore) {
+        return;
+    }
+    const commentList = document.getElementById('comment-list');
+    loadMore.addEventListener('click', function(event) {
+        event.preventDefault();
+        fetch(loadMore.dataset.endpoint + '?after=' + loadMore.dataset.after)
+            .then(response => response.json())
+            .then(data => {
+                data.comments.forEach(comment => {
+                    const item = document.createElement('li');
+                    const image = document.createElement('div');
+                    image.className = 'commenterImage';
+                    const avatar = document.createElement('img');
+                    avatar.src = comment.avatar;
+                    image.appendChild(avatar);
+                    const text = document.createElement('div');
+                    text.className = 'commentText';
+                    const author = document.createElement('span');
+                    author.className = 'sub-text';
+                    author.textContent = comment.author;
+                    const body = document.createElement('div');
+                    body.textContent = comment.text;
+                    text.append(author, body);
+                    if (comment.delete_url) {
+                        const remove = document.createElement('a');
+                        remove.href = comment.delete_url;
+                        remove.id = 'delete-comment-link';
+                        remove.textContent = 'Delete';
+                        text.appendChild(remove);
+                    }
+                    item.append(image, text);
+                    commentList.appendChild(item);
+                });
+                if (data.next) {
+                    loadMore.dataset.after = data.next;
+                } else {
+                    loadMore.remove();
+                }
+            });
+    });
+})
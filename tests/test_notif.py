@@ -0,0 +1,18 @@
+from email import message_from_string, policy
+from notif import build_message
+
+
+def test_line_breaks_in_headers_are_flattened():
+    message = build_message("Hello\r\nBcc: victim@example.com", "reader@example.com\nCc: other@example.com",
+                            "blog@example.com", "Line one\nLine two")
+    parsed = message_from_string(message.as_string(), policy=policy.SMTP)
+    assert parsed['Subject'] == "Hello Bcc: victim@example.com"
+    assert parsed['Bcc'] is None
+    assert parsed['Cc'] is None
+    assert parsed.get_content() == "Line one\r\nLine two\r\n"
+
+
+def test_non_ascii_is_encoded():
+    text = build_message("Café", "zoë@example.com", "blog@example.com", "Merci, café").as_string()
+    assert text.isascii()
+    assert message_from_string(text, policy=policy.SMTP)['Subject'] == "Café"
@@ -0,0 +1,171 @@
+from datetime import datetime
+from flask.cli import AppGroup
+from sqlalchemy import DateTime, inspect
+from models import BlogPost, Comment, Image, User, db
+from cache import page_cache
+import click
+import feeds
+import gzip
+import json
+import os
+import tempfile
+import time
+
+# Copies the users, posts and comments between databases (e.g. SQLite to Postgres) through gzipped
+# NDJSON files, one row per line. Both directions stream in batches, so memory use stays the same
+# for a thousand rows or ten million. The uploaded image files (IMAGE_DIR) are copied separately.
+
+# Parents before children so the foreign keys are always satisfied
+TABLES = [User.__table__, Image.__table__, BlogPost.__table__, Comment.__table__]
+
+data_cli = AppGroup('data', help="Export and import the blog data.")
+
+
+def to_json(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot export {type(value).__name__}")
+
+
+class Progress:
+    def __init__(self, label, every):
+        self.label = label
+        self.every = every
+        self.count = 0
+        self.started = time.perf_counter()
+
+    def add(self, rows):
+        before = self.count
+        self.count += rows
+        if self.count // self.every != before // self.every:
+            self.report()
+
+    def rate(self):
+        return self.count / max(time.perf_counter() - self.started, 1e-9)
+
+    def report(self, done=False):
+        click.echo(f"{self.label}: {self.count} rows, {self.rate():,.0f} rows/sec{' (done)' if done else ''}")
+
+
+def current_revision(connection):
+    if not inspect(connection).has_table('alembic_version'):
+        return None
+    return connection.execute(db.text("SELECT version_num FROM alembic_version")).scalar()
+
+
+@data_cli.command('export')
+@click.argument('directory')
+@click.option('--batch-size', default=5000, help="Rows fetched from the database at a time.")
+def export_data(directory, batch_size):
+    """Write every user, post and comment to DIRECTORY as gzipped NDJSON files."""
+    os.makedirs(directory, exist_ok=True)
+    manifest = {"created_at": datetime.now().isoformat(timespec="seconds"), "tables": {}}
+    started = time.perf_counter()
+    with db.engine.connect() as connection:
+        # One snapshot for all the tables, so no comment points at a post that was not exported
+        if connection.dialect.name == 'postgresql':
+            connection = connection.execution_options(isolation_level='REPEATABLE READ')
+        manifest["revision"] = current_revision(connection)
+        for table in TABLES:
+            progress = Progress(table.name, batch_size * 20)
+            path = os.path.join(directory, f"{table.name}.ndjson.gz")
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            os.close(fd)
+            # stream_results uses a server-side cursor where the driver has one (psycopg2)
+            result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(
+                table.select().order_by(*table.primary_key.columns))
+            try:
+                with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+                    for rows in result.mappings().partitions():
+                        f.writelines(json.dumps(dict(row), default=to_json, separators=(',', ':')) + "\n"
+                                     for row in rows)
+                        progress.add(len(rows))
+                os.replace(tmp, path)
+            except BaseException:
+                os.remove(tmp)
+                raise
+            progress.report(done=True)
+            manifest["tables"][table.name] = {"file": os.path.basename(path), "rows": progress.count,
+                                              "columns": [column.name for column in table.columns]}
+        connection.rollback()
+
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    click.echo(f"Exported to {directory} in {time.perf_counter() - started:.1f}s")
+
+
+def read_rows(path, table, after_id):
+    dates = {column.name for column in table.columns if isinstance(column.type, DateTime)}
+    names = {column.name for column in table.columns}
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            row = json.loads(line)
+            if row['id'] <= after_id:
+                continue
+            # Columns the target no longer has are dropped, ones it gained get their defaults
+            row = {key: value for key, value in row.items() if key in names}
+            for name in dates & row.keys():
+                if row[name] is not None:
+                    row[name] = datetime.fromisoformat(row[name])
+            yield row
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Rows are inserted with their ids, so point the Postgres sequences past them for new rows
+def reset_sequence(connection, table):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {table.name}), 0) + 1, false)"))
+
+
+@data_cli.command('import')
+@click.argument('directory')
+@click.option('--batch-size', default=5000, help="Rows inserted and committed at a time.")
+def import_data(directory, batch_size):
+    """Load an export from DIRECTORY into this database. Running it again after a failure carries on
+    where it stopped."""
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        manifest = json.load(f)
+    started = time.perf_counter()
+    with db.engine.connect() as connection:
+        revision = current_revision(connection)
+        if revision != manifest.get("revision"):
+            click.echo(f"Warning: the export is from revision {manifest.get('revision')}, "
+                       f"this database is at {revision}", err=True)
+        connection.rollback()
+
+        for table in TABLES:
+            entry = manifest["tables"].get(table.name)
+            if entry is None:  # an export made before the table existed
+                click.echo(f"{table.name}: not in the export, skipped")
+                continue
+            # Every batch is committed on its own, so the highest id already here is where the
+            # previous run stopped (the files are written in id order)
+            after_id = connection.execute(db.select(db.func.max(table.c.id))).scalar() or 0
+            connection.rollback()
+            if after_id:
+                click.echo(f"{table.name}: resuming after id {after_id}")
+            progress = Progress(table.name, batch_size * 20)
+            rows = read_rows(os.path.join(directory, entry["file"]), table, after_id)
+            for batch in batches(rows, batch_size):
+                with connection.begin():
+                    connection.execute(table.insert(), batch)
+                progress.add(len(batch))
+            with connection.begin():
+                reset_sequence(connection, table)
+            progress.report(done=True)
+
+    page_cache.invalidate("index", "archive")
+    feeds.invalidate()
+    click.echo(f"Imported from {directory} in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,53 @@
+from flask_login import UserMixin
+from sqlalchemy.orm import load_only
+from cache import backend_from_config
+from models import User, db
+
+
+# What Flask-Login keeps as current_user. It only carries the columns the templates read,
+# so checking current_user.id or .name never lazy loads the user's posts or comments.
+class UserIdentity(UserMixin):
+    def __init__(self, id, name, email):
+        self.id = id
+        self.name = name
+        self.email = email
+
+    def __repr__(self):
+        return f"<UserIdentity {self.id}>"
+
+
+# Caches user identities by id so logged-in requests don't query the users table every time
+class UserCache:
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = backend_from_config(app, 'USER_CACHE')
+        app.extensions['user_cache'] = self
+
+    def get(self, user_id):
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+        key = f"user:{user_id}"
+        fields = self.backend.get(key) if self.backend is not None else None
+        if fields is None:
+            user = db.session.execute(
+                db.select(User).options(load_only(User.id, User.name, User.email)).where(User.id == user_id)
+            ).scalar()
+            if not user:
+                return None
+            fields = (user.id, user.name, user.email)
+            if self.backend is not None:
+                self.backend.set(key, fields)
+        return UserIdentity(*fields)
+
+    def invalidate(self, user_id):
+        if self.backend is not None:
+            self.backend.delete(f"user:{user_id}")
+
+
+user_cache = UserCache()
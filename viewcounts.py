@@ -0,0 +1,161 @@
+from collections import Counter
+from datetime import timedelta
+from functools import wraps
+from flask import current_app, request, make_response
+from sqlalchemy import desc, func, insert, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from models import BlogPost, PostView, db, utcnow
+import atexit
+import logging
+import threading
+import time
+
+# Post views are counted in memory by every worker and written to post_views (one row per post and
+# day) in a single batched upsert every VIEW_FLUSH_INTERVAL seconds, or sooner once VIEW_FLUSH_SIZE
+# views are waiting. The post page never writes to blog_posts, so readers do not queue behind each
+# other on the SQLite write lock or on one hot Postgres row.
+#
+# Counts are best effort. Views not yet flushed are lost when a worker is killed (a clean shutdown
+# flushes them), so a crash loses at most VIEW_FLUSH_INTERVAL seconds or VIEW_FLUSH_SIZE views per
+# worker, and a flush the database rejects is logged and dropped rather than retried. Pages answered
+# from the prerendered files (see prerender.py) never reach the app and are not counted.
+
+logger = logging.getLogger(__name__)
+
+
+# Adds the rows' counts to post_views in one statement where the database has an upsert, otherwise
+# updates each row and inserts the ones that were not there yet
+def add_views(connection, rows):
+    table = PostView.__table__
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        statement = (postgresql_insert if dialect == 'postgresql' else sqlite_insert)(table)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.post_id, table.c.day],
+            set_={"count": table.c.count + statement.excluded["count"]}), rows)
+    elif dialect in ('mysql', 'mariadb'):
+        statement = mysql_insert(table)
+        connection.execute(statement.on_duplicate_key_update(count=table.c.count + statement.inserted["count"]), rows)
+    else:
+        for row in rows:
+            updated = connection.execute(
+                update(table)
+                .where(table.c.post_id == row["post_id"], table.c.day == row["day"])
+                .values(count=table.c.count + row["count"])
+            ).rowcount
+            if not updated:
+                connection.execute(insert(table), row)
+
+
+class ViewCounter:
+    def __init__(self, app=None):
+        self.app = None
+        self._pending = Counter()
+        self._waiting = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._popular = (None, [])
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VIEW_COUNTS_ENABLED', True)
+        app.config.setdefault('VIEW_FLUSH_INTERVAL', 30)
+        app.config.setdefault('VIEW_FLUSH_SIZE', 1000)
+        app.config.setdefault('POPULAR_POSTS_SIZE', 5)
+        app.config.setdefault('POPULAR_POSTS_DAYS', 7)
+        app.config.setdefault('POPULAR_POSTS_TTL', 300)
+        app.extensions['view_counter'] = self
+        if not app.config['VIEW_COUNTS_ENABLED']:
+            return
+        if self.app is None:
+            atexit.register(self.flush_at_exit)
+        self.app = app
+        app.teardown_request(self.flush_if_due)
+
+    def record(self, post_id):
+        with self._lock:
+            self._pending[(post_id, utcnow().date())] += 1
+            self._waiting += 1
+
+    # Runs after the response is finished, so its statements are not part of the request's query budget
+    def flush_if_due(self, exc=None):
+        config = current_app.config
+        if (self._waiting >= config['VIEW_FLUSH_SIZE']
+                or time.monotonic() - self._last_flush >= config['VIEW_FLUSH_INTERVAL']):
+            self.flush()
+
+    def flush(self):
+        # Only one thread writes at a time, the others keep counting
+        if not self._flush_lock.acquire(blocking=False):
+            return 0
+        try:
+            with self._lock:
+                pending, self._pending = self._pending, Counter()
+                self._waiting = 0
+                self._last_flush = time.monotonic()
+            if not pending:
+                return 0
+            rows = [{"post_id": post_id, "day": day, "count": count} for (post_id, day), count in pending.items()]
+            try:
+                with db.engine.begin() as connection:
+                    add_views(connection, rows)
+            except SQLAlchemyError:
+                logger.exception("Dropped %d post views that could not be written", sum(pending.values()))
+                return 0
+            return len(rows)
+        finally:
+            self._flush_lock.release()
+
+    def flush_at_exit(self):
+        if self._pending and self.app is not None:
+            with self.app.app_context():
+                self.flush()
+
+    # Decorator for the post page: a view is a successful GET, including a 304 for a page the browser kept
+    def counted(self, f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            response = make_response(f(*args, **kwargs))
+            if (request.method == 'GET' and response.status_code in (200, 304)
+                    and current_app.config['VIEW_COUNTS_ENABLED']):
+                self.record(kwargs['post_id'])
+            return response
+
+        return decorated_function
+
+    # Most viewed posts of the last POPULAR_POSTS_DAYS days. Computed once per popular_version() in
+    # each worker and kept as plain dicts, so the index page only runs the query when it is stale.
+    def popular_posts(self):
+        config = current_app.config
+        version = self.popular_version()
+        computed_version, posts = self._popular
+        if computed_version == version:
+            return posts
+        since = utcnow().date() - timedelta(days=config['POPULAR_POSTS_DAYS'] - 1)
+        views = db.select(PostView.post_id, func.sum(PostView.count).label('views')) \
+            .where(PostView.day >= since).group_by(PostView.post_id).subquery()
+        rows = db.session.execute(
+            db.select(BlogPost.id, BlogPost.title, BlogPost.subtitle, views.c.views)
+            .join(views, views.c.post_id == BlogPost.id)
+            .order_by(desc(views.c.views), desc(BlogPost.id))
+            .limit(config['POPULAR_POSTS_SIZE'])
+        ).all()
+        posts = [row._asdict() for row in rows]
+        self._popular = (version, posts)
+        return posts
+
+    # Changes every POPULAR_POSTS_TTL seconds, the same in every worker. Part of the index page's ETag
+    # and page-cache key, and the list is recomputed when it changes.
+    def popular_version(self):
+        return int(time.time() // current_app.config['POPULAR_POSTS_TTL'])
+
+    def forget(self, post_id):
+        db.session.execute(db.delete(PostView).where(PostView.post_id == post_id))
+
+
+view_counter = ViewCounter()